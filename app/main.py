@@ -6,14 +6,19 @@ from handlers.start import register_handlers as register_start_handler
 from handlers.portfolio import register_handlers as register_portfolio_handler
 from handlers.team import register_handlers as register_team_handler
 from handlers.admin import register_handlers as register_admin_handler
+from handlers.filters import register_filters
 from app.webhook import app
-from db.db import init_db
+from db.db import init_db, init_pool, close_pool
+from db.admin import load_admin_ids
+from db.tag_cache import flush_tag_cache_hits
+from services.http_client import open_http_clients, close_http_clients
 from app.loger_setup import get_logger
 
 
 logger = get_logger(__name__, level="INFO")
 
 async def register_all_handlers():
+    register_filters(dp)
     register_admin_handler(dp)
     register_start_handler(dp)
     register_portfolio_handler(dp)
@@ -22,12 +27,22 @@ async def register_all_handlers():
 
 
 async def on_startup(_):
+    await init_pool()
     await init_db()
+    await load_admin_ids()
     logger.info("База данных подключена")
+    await open_http_clients()
+
+
+async def on_shutdown(_):
+    await close_http_clients()
+    await flush_tag_cache_hits()
+    await close_pool()
+    logger.info("Соединения с базой данных закрыты")
 
 
 def start_polling():
-    executor.start_polling(dp, skip_updates=True, on_startup=on_startup, timeout=60)
+    executor.start_polling(dp, skip_updates=True, on_startup=on_startup, on_shutdown=on_shutdown, timeout=60)
 
 
 def main():
@@ -0,0 +1,94 @@
+"""Подсчёт конфликтов тегов: множества Python против битовых масок TagBitIndex.
+
+Жадный проход как в TeamDistributor.distribute_users (шаги 1-2) на синтетических данных.
+Запуск из корня репозитория:
+    python -m benchmarks.conflicts [--users 10000] [--teams 500] [--tags 300]
+"""
+import argparse
+import random
+import time
+
+from services.team_logic import TagBitIndex, conflict_count
+
+
+def make_users(num_users: int, num_tags: int, seed: int = 42):
+    rnd = random.Random(seed)
+    # Популярность тегов неравномерная, как в реальных портфолио
+    weights = [1 / (rank + 1) for rank in range(num_tags)]
+    return [list(set(rnd.choices(range(num_tags), weights, k=rnd.randint(3, 8)))) for _ in range(num_users)]
+
+
+def greedy_sets(users, num_teams: int, max_team_size: int):
+    teams = [set() for _ in range(num_teams)]
+    members = [0] * num_teams
+    result = []
+    for tags in users:
+        user_tags = set(tags)
+        best, best_key = None, None
+        for i, team_tags in enumerate(teams):
+            if members[i] >= max_team_size:
+                continue
+            conflicts = len(team_tags.intersection(user_tags))
+            if conflicts == 0:
+                best = i
+                break
+            if best_key is None or (conflicts, members[i]) < best_key:
+                best, best_key = i, (conflicts, members[i])
+        teams[best].update(user_tags)
+        members[best] += 1
+        result.append(best)
+    return result
+
+
+def greedy_masks(users, num_teams: int, max_team_size: int, index: TagBitIndex):
+    teams = [0] * num_teams
+    members = [0] * num_teams
+    result = []
+    for tags in users:
+        user_mask = index.mask(tags)
+        best, best_key = None, None
+        for i, team_mask in enumerate(teams):
+            if members[i] >= max_team_size:
+                continue
+            if not team_mask & user_mask:
+                best = i
+                break
+            key = (conflict_count(team_mask, user_mask), members[i])
+            if best_key is None or key < best_key:
+                best, best_key = i, key
+        teams[best] |= user_mask
+        members[best] += 1
+        result.append(best)
+    return result
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def main(num_users: int, num_teams: int, num_tags: int):
+    users = make_users(num_users, num_tags)
+    max_team_size = -(-num_users // num_teams)
+    index = TagBitIndex()
+
+    by_sets, sets_time = timed(greedy_sets, users, num_teams, max_team_size)
+    by_masks, cold_time = timed(greedy_masks, users, num_teams, max_team_size, index)
+    # Второй прогон: отображение тегов в биты уже построено и переиспользуется
+    _, warm_time = timed(greedy_masks, users, num_teams, max_team_size, index)
+
+    assert by_sets == by_masks, "битовые маски дали другое распределение"
+    print(f"{num_users} пользователей, {num_teams} команд, {num_tags} тегов")
+    print(f"  set.intersection:        {sets_time:7.2f} s")
+    print(f"  битовые маски (холодно): {cold_time:7.2f} s  (x{sets_time / cold_time:.1f})")
+    print(f"  битовые маски (тепло):   {warm_time:7.2f} s  (x{sets_time / warm_time:.1f})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--teams", type=int, default=500)
+    parser.add_argument("--tags", type=int, default=300)
+    args = parser.parse_args()
+    main(args.users, args.teams, args.tags)
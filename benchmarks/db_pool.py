@@ -0,0 +1,87 @@
+"""Сравнение пропускной способности: соединение на каждый запрос против общего пула.
+
+Запуск из корня репозитория:
+    python -m benchmarks.db_pool [--ops 2000] [--concurrency 8]
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+
+import aiosqlite
+
+from db.db import ConnectionPool
+from db.migrations import run_migrations
+
+SELECT_USER = "SELECT user_id, username, portfolio, team_id FROM users WHERE user_id = ?"
+UPDATE_USERNAME = "UPDATE users SET username = ? WHERE user_id = ?"
+NUM_USERS = 1000
+
+
+async def prepare(path: Path):
+    async with aiosqlite.connect(path) as db:
+        await run_migrations(db)
+        await db.executemany(
+            "INSERT INTO users (user_id, username, portfolio, relevance) VALUES (?, ?, ?, 1)",
+            [(i, f"user{i}", "портфолио " * 20) for i in range(NUM_USERS)]
+        )
+        await db.commit()
+
+
+async def one_op_per_connection(path: Path, i: int):
+    # Так работали хелперы db/* до появления пула
+    async with aiosqlite.connect(path) as db:
+        cursor = await db.execute(SELECT_USER, (i % NUM_USERS,))
+        await cursor.fetchone()
+    async with aiosqlite.connect(path) as db:
+        await db.execute(UPDATE_USERNAME, (f"user{i}", i % NUM_USERS))
+        await db.commit()
+
+
+async def one_op_pooled(pool: ConnectionPool, i: int):
+    async with pool.acquire() as db:
+        cursor = await db.execute(SELECT_USER, (i % NUM_USERS,))
+        await cursor.fetchone()
+    async with pool.acquire() as db:
+        await db.execute(UPDATE_USERNAME, (f"user{i}", i % NUM_USERS))
+        await db.commit()
+
+
+async def run(op, ops: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def guarded(i):
+        async with semaphore:
+            await op(i)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(guarded(i) for i in range(ops)))
+    return ops / (time.perf_counter() - started)
+
+
+async def main(ops: int, concurrency: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "bench.db"
+        await prepare(path)
+
+        before = await run(lambda i: one_op_per_connection(path, i), ops, concurrency)
+
+        pool = ConnectionPool(path)
+        await pool.open()
+        try:
+            after = await run(lambda i: one_op_pooled(pool, i), ops, concurrency)
+        finally:
+            await pool.close()
+
+    print(f"Операций (select + update): {ops}, параллельно: {concurrency}")
+    print(f"  соединение на запрос: {before:10.1f} ops/sec")
+    print(f"  общий пул:            {after:10.1f} ops/sec  (x{after / before:.1f})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ops", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+    asyncio.run(main(args.ops, args.concurrency))
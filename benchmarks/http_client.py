@@ -0,0 +1,73 @@
+"""Задержка запросов к LLM: новая ClientSession на каждый вызов против общей keep-alive сессии.
+
+По умолчанию поднимает локальный aiohttp-сервер (только TCP-рукопожатие); --url позволяет
+измерить реальный HTTPS-эндпоинт, где разница больше за счёт TLS. Запуск из корня репозитория:
+    python -m benchmarks.http_client [--requests 200] [--url https://...]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import aiohttp
+from aiohttp import web
+
+from services.http_client import close_http_clients, get_session
+
+
+async def start_server():
+    async def handle(_):
+        return web.json_response({"choices": [{"message": {"content": "ok"}}]})
+
+    app = web.Application()
+    app.router.add_post("/", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/"
+
+
+async def per_call_session(url: str):
+    async with aiohttp.ClientSession() as session:
+        async with session.post(url, json={}) as response:
+            await response.read()
+
+
+async def shared_session(url: str):
+    async with get_session("local").post(url, json={}) as response:
+        await response.read()
+
+
+async def measure(call, url: str, requests: int):
+    latencies = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        await call(url)
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1]
+
+
+async def main(requests: int, url: str):
+    runner = None
+    if not url:
+        runner, url = await start_server()
+    try:
+        print(f"{requests} последовательных запросов к {url}")
+        for name, call in (("новая сессия на вызов", per_call_session), ("общая сессия", shared_session)):
+            median, p95 = await measure(call, url, requests)
+            print(f"  {name:<22} медиана {median:7.2f} ms, p95 {p95:7.2f} ms")
+    finally:
+        await close_http_clients()
+        if runner:
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--url", default="")
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.url))
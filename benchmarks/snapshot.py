@@ -0,0 +1,101 @@
+"""Загрузка участников: словари с портфолио против колоночного ParticipantSnapshot и его mmap-файла.
+
+Синтетическая база во временном каталоге. Запуск из корня репозитория:
+    python -m benchmarks.snapshot [--users 50000] [--portfolio-chars 2000]
+"""
+import argparse
+import asyncio
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import aiosqlite
+
+from benchmarks.conflicts import make_users
+from db.migrations import run_migrations
+from db.snapshot import ParticipantSnapshot
+
+
+async def create_db(path: Path):
+    async with aiosqlite.connect(path) as db:
+        await run_migrations(db)
+
+
+def fill_db(path: Path, num_users: int, portfolio_chars: int):
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany("INSERT INTO tag_dictionary (name) VALUES (?)", [(f"tag{i}",) for i in range(300)])
+        conn.executemany(
+            "INSERT INTO users (user_id, username, portfolio, relevance) VALUES (?, ?, ?, 1)",
+            [(user_id, f"user{user_id}", "x" * portfolio_chars) for user_id in range(num_users)]
+        )
+        conn.executemany(
+            "INSERT INTO user_tags (user_id, tag_id) VALUES (?, ?)",
+            [(user_id, tag + 1) for user_id, tags in enumerate(make_users(num_users, 300)) for tag in tags]
+        )
+    conn.close()
+
+
+def load_dicts(path: Path):
+    # Прежний get_users_to_distribute: словарь на пользователя вместе с портфолио
+    conn = sqlite3.connect(path)
+    rows = conn.execute("""
+        SELECT u.user_id, u.username, u.portfolio,
+               (SELECT GROUP_CONCAT(ut.tag_id) FROM user_tags ut WHERE ut.user_id = u.user_id)
+        FROM users u
+        WHERE u.relevance = 1 AND u.team_id IS NULL
+    """).fetchall()
+    users = [
+        {"user_id": row[0], "username": row[1], "portfolio": row[2],
+         "tags": [int(tag_id) for tag_id in row[3].split(",")] if row[3] else []}
+        for row in rows
+    ]
+    conn.close()
+    return users
+
+
+def load_snapshot(path: Path):
+    conn = sqlite3.connect(path)
+    snapshot = ParticipantSnapshot.load(conn)
+    conn.close()
+    return snapshot
+
+
+def measure(fn, *args):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / 2 ** 20
+
+
+def main(num_users: int, portfolio_chars: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "bench.db"
+        snap_path = Path(tmp) / "participants.snap"
+        asyncio.run(create_db(db_path))
+        fill_db(db_path, num_users, portfolio_chars)
+
+        users, dict_time, dict_mem = measure(load_dicts, db_path)
+        snapshot, snap_time, snap_mem = measure(load_snapshot, db_path)
+        assert [user["tags"] for user in users] == [list(tags) for tags in snapshot.tag_lists()]
+        snapshot.save(snap_path)
+        mapped, open_time, open_mem = measure(ParticipantSnapshot.open, snap_path)
+        assert list(mapped.tag_ids) == list(snapshot.tag_ids)
+
+        print(f"{num_users} пользователей, портфолио по {portfolio_chars} символов")
+        print(f"  словари с портфолио:   {dict_time:6.3f} s, пик {dict_mem:7.1f} MiB")
+        print(f"  ParticipantSnapshot:   {snap_time:6.3f} s, пик {snap_mem:7.1f} MiB")
+        print(f"  mmap-файл ({snap_path.stat().st_size / 2 ** 20:.1f} MiB): {open_time:6.3f} s, пик {open_mem:7.1f} MiB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50_000)
+    parser.add_argument("--portfolio-chars", type=int, default=2000)
+    args = parser.parse_args()
+    main(args.users, args.portfolio_chars)
@@ -0,0 +1,51 @@
+"""Векторный планировщик против жадного: совпадение назначений и время на больших объёмах.
+
+Запуск из корня репозитория:
+    python -m benchmarks.vectorized [--users 100000] [--teams 500] [--check-users 10000]
+"""
+import argparse
+import copy
+import time
+
+from benchmarks.conflicts import make_users
+from services.team_logic import plan_greedy, plan_vectorized
+
+
+def make_plan_input(num_users: int, num_teams: int, num_tags: int):
+    users = make_users(num_users, num_tags)
+    teams = [{"id": i + 1, "color": "A", "members": 0, "tags": []} for i in range(num_teams)]
+    return users, teams
+
+
+def timed(planner, users, teams, max_team_size):
+    teams = copy.deepcopy(teams)
+    started = time.perf_counter()
+    placements = planner(users, teams, {"A": len(teams)}, max_team_size)
+    return placements, time.perf_counter() - started
+
+
+def main(num_users: int, num_teams: int, num_tags: int, check_users: int):
+    users, teams = make_plan_input(check_users, num_teams, num_tags)
+    max_team_size = -(-check_users // num_teams)
+    greedy, greedy_time = timed(plan_greedy, users, teams, max_team_size)
+    vectorized, vectorized_time = timed(plan_vectorized, users, teams, max_team_size)
+    assert greedy == vectorized, "векторный режим разошёлся с жадным"
+    print(f"{check_users} пользователей, {num_teams} команд: назначения совпадают")
+    print(f"  жадный:   {greedy_time:7.2f} s")
+    print(f"  векторный: {vectorized_time:6.2f} s")
+
+    users, teams = make_plan_input(num_users, num_teams, num_tags)
+    max_team_size = -(-num_users // num_teams)
+    _, vectorized_time = timed(plan_vectorized, users, teams, max_team_size)
+    print(f"{num_users} пользователей, {num_teams} команд")
+    print(f"  векторный: {vectorized_time:6.2f} s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--teams", type=int, default=500)
+    parser.add_argument("--tags", type=int, default=300)
+    parser.add_argument("--check-users", type=int, default=10_000)
+    args = parser.parse_args()
+    main(args.users, args.teams, args.tags, args.check_users)
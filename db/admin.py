@@ -1,41 +1,81 @@
-import aiosqlite
-from db.db import DB_PATH
+from typing import AsyncIterator, Optional, Set
+from db.db import connection
 
 
 async def get_admin_user_ids() -> list[int]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with connection() as db:
         cursor = await db.execute("SELECT user_id FROM admin")
         rows = await cursor.fetchall()
         return [row[0] for row in rows]
 
 
+# Загружается при старте и пополняется в add_admin, чтобы фильтры не ходили в базу
+_admin_ids: Optional[Set[int]] = None
+
+
+async def load_admin_ids() -> Set[int]:
+    global _admin_ids
+    _admin_ids = set(await get_admin_user_ids())
+    return _admin_ids
+
+
+async def is_admin(user_id: int) -> bool:
+    admin_ids = _admin_ids if _admin_ids is not None else await load_admin_ids()
+    return user_id in admin_ids
+
+
 async def add_admin(user_id: int) -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with connection() as db:
         await db.execute(
             "INSERT OR IGNORE INTO admin (user_id) VALUES (?)",
             (user_id,)
         )
         await db.commit()
+    if _admin_ids is not None:
+        _admin_ids.add(user_id)
+
+
+async def iter_relevant_users_with_tags() -> AsyncIterator[dict]:
+    """Актуальные пользователи с тегами одним JOIN-запросом, по одному по мере чтения курсора.
+
+    Пока генератор не исчерпан (или не закрыт), он держит соединение из пула.
+    """
+    async with connection() as db:
+        async with db.execute("""
+            SELECT u.user_id, u.username, d.name
+            FROM users u
+            LEFT JOIN user_tags ut ON ut.user_id = u.user_id
+            LEFT JOIN tag_dictionary d ON d.id = ut.tag_id
+            WHERE u.relevance = 1
+            ORDER BY u.user_id
+        """) as cursor:
+            current = None
+            async for user_id, username, tag in cursor:
+                if current is None or current["user_id"] != user_id:
+                    if current is not None:
+                        yield current
+                    current = {"user_id": user_id, "username": username, "tags": []}
+                if tag is not None:
+                    current["tags"].append(tag)
+            if current is not None:
+                yield current
 
 
-async def get_relevant_users_with_tags():
-    results = []
+async def get_relevant_users_with_tags() -> list[dict]:
+    return [user async for user in iter_relevant_users_with_tags()]
 
-    async with aiosqlite.connect("main.db") as db:
-        # Получаем пользователей с relevance = True
-        async with db.execute("SELECT user_id, username FROM users WHERE relevance = 1") as cursor:
-            users = await cursor.fetchall()
 
-        for user_id, username in users:
-            # Получаем теги для каждого пользователя
-            async with db.execute("SELECT tag FROM tags WHERE user_id = ?", (user_id,)) as tag_cursor:
-                tag_rows = await tag_cursor.fetchall()
-                tags = [row[0] for row in tag_rows]
+async def count_relevant_users() -> int:
+    async with connection() as db:
+        cursor = await db.execute("SELECT COUNT(*) FROM users WHERE relevance = 1")
+        return (await cursor.fetchone())[0]
 
-            results.append({
-                "user_id": user_id,
-                "username": username,
-                "tags": tags
-            })
 
-    return results
+async def count_relevant_users_with_tags() -> int:
+    async with connection() as db:
+        cursor = await db.execute("""
+            SELECT COUNT(*) FROM users u
+            WHERE u.relevance = 1
+              AND EXISTS (SELECT 1 FROM user_tags ut WHERE ut.user_id = u.user_id)
+        """)
+        return (await cursor.fetchone())[0]
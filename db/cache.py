@@ -0,0 +1,75 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable
+
+_MISSING = object()
+
+
+class TTLCache:
+    """LRU-кэш ограниченного размера с временем жизни записей и счётчиками попаданий."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        # Версии для set_if_unchanged: растут при каждой записи в базу по ключу (touch/invalidate) и при clear
+        self._epoch = 0
+        self._versions: Dict[Hashable, int] = {}
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING or entry[0] < time.monotonic():
+            if entry is not _MISSING:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Значение без учёта в статистике и без продления LRU-позиции."""
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING or entry[0] < time.monotonic():
+            return default
+        return entry[1]
+
+    def version(self, key: Hashable) -> tuple:
+        """Запоминается перед чтением из базы и передаётся в set_if_unchanged."""
+        return self._epoch, self._versions.get(key, 0)
+
+    def touch(self, key: Hashable):
+        """Отмечает запись ключа в базе: идущие сейчас чтения не положат в кэш старое значение."""
+        self._versions[key] = self._versions.get(key, 0) + 1
+
+    def set_if_unchanged(self, key: Hashable, value: Any, version: tuple) -> bool:
+        if self.version(key) != version:
+            return False
+        self.set(key, value)
+        return True
+
+    def invalidate(self, key: Hashable):
+        self.touch(key)
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._epoch += 1
+        self._versions.clear()
+        self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._data),
+            "hit_rate": self.hits / total if total else 0.0,
+        }
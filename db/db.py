@@ -1,44 +1,97 @@
+import asyncio
 import aiosqlite
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import AsyncIterator, List, Optional
+from db.migrations import run_migrations, check_query_plans
 
-DB_PATH = Path("main.db")
-
-TABLES = {
-    "users": """
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER UNIQUE,
-            username TEXT,
-            portfolio TEXT,
-            team_id INTEGER,
-            relevance BOOL
-        );
-    """,
-    "tags": """
-        CREATE TABLE IF NOT EXISTS tags (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER UNIQUE,
-            tag TEXT
-        );
-    """,
-    "teams": """
-        CREATE TABLE IF NOT EXISTS teams (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            colors TEXT,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP
-        );   
-    """,
-    "admin": """
-        CREATE TABLE IF NOT EXISTS admin (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER UNIQUE
-        );
+# Абсолютный путь: пул и синхронные соединения db.teams должны видеть один файл из любого рабочего каталога
+DB_PATH = Path(__file__).resolve().parent.parent / "main.db"
+
+POOL_SIZE = 4
+BUSY_TIMEOUT_MS = 5000
+STATEMENT_CACHE_SIZE = 256
+
+# Применяются к каждому соединению пула один раз при открытии
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}",
+)
+
+class ConnectionPool:
+    """Пул долгоживущих соединений aiosqlite.
+
+    Каждое соединение открывается один раз (WAL, synchronous=NORMAL, busy timeout)
+    и держит собственный кэш подготовленных выражений, поэтому повторные запросы
+    не платят ни за запуск потока, ни за повторный разбор SQL.
     """
-}
+
+    def __init__(self, path: Path = DB_PATH, size: int = POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._connections: List[aiosqlite.Connection] = []
+        self._idle: asyncio.Queue = asyncio.Queue()
+
+    async def open(self):
+        for _ in range(self.size):
+            conn = aiosqlite.connect(self.path, cached_statements=STATEMENT_CACHE_SIZE)
+            conn.daemon = True  # не блокируем выход процесса, если пул не закрыли
+            await conn
+            conn.row_factory = aiosqlite.Row
+            for pragma in PRAGMAS:
+                await conn.execute(pragma)
+            self._connections.append(conn)
+            self._idle.put_nowait(conn)
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[aiosqlite.Connection]:
+        conn = await self._idle.get()
+        try:
+            yield conn
+        finally:
+            # Незакоммиченная транзакция не должна достаться следующему владельцу
+            if conn.in_transaction:
+                await conn.rollback()
+            self._idle.put_nowait(conn)
+
+    async def close(self):
+        for conn in self._connections:
+            await conn.close()
+        self._connections.clear()
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = asyncio.Lock()
+
+
+async def init_pool(path: Path = DB_PATH, size: int = POOL_SIZE) -> ConnectionPool:
+    global _pool
+    async with _pool_lock:
+        if _pool is None:
+            pool = ConnectionPool(path, size)
+            await pool.open()
+            _pool = pool
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    async with _pool_lock:
+        if _pool is not None:
+            await _pool.close()
+            _pool = None
+
+
+@asynccontextmanager
+async def connection() -> AsyncIterator[aiosqlite.Connection]:
+    """Выдаёт соединение из общего пула (пул создаётся лениво, если on_startup не вызывался)."""
+    pool = _pool or await init_pool()
+    async with pool.acquire() as db:
+        yield db
 
 
 async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
-        for query in TABLES.values():
-            await db.execute(query)
-        await db.commit()
+    async with connection() as db:
+        await run_migrations(db)
+        await check_query_plans(db)
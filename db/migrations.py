@@ -0,0 +1,179 @@
+import json
+import aiosqlite
+from typing import Awaitable, Callable, List, Optional, Tuple, Union
+
+from db.snapshot import PARTICIPANTS_QUERY
+
+Step = Union[str, Callable[[aiosqlite.Connection], Awaitable[None]]]
+
+BASE_TABLES = {
+    "users": """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER UNIQUE,
+            username TEXT,
+            portfolio TEXT,
+            team_id INTEGER,
+            relevance BOOL
+        );
+    """,
+    "tag_dictionary": """
+        CREATE TABLE IF NOT EXISTS tag_dictionary (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE
+        );
+    """,
+    "user_tags": """
+        CREATE TABLE IF NOT EXISTS user_tags (
+            user_id INTEGER NOT NULL,
+            tag_id INTEGER NOT NULL REFERENCES tag_dictionary (id),
+            PRIMARY KEY (user_id, tag_id)
+        ) WITHOUT ROWID;
+    """,
+    "teams": """
+        CREATE TABLE IF NOT EXISTS teams (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            colors TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        );
+    """,
+    "admin": """
+        CREATE TABLE IF NOT EXISTS admin (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER UNIQUE
+        );
+    """
+}
+
+
+def parse_legacy_tags(raw: Optional[str]) -> List[str]:
+    """Разбирает старый формат tags.tag: JSON-список или строку через запятую."""
+    if not raw:
+        return []
+    try:
+        tags = json.loads(raw)
+    except ValueError:
+        tags = raw.split(",")
+    if isinstance(tags, str):
+        tags = [tags]
+    return [str(tag).strip().strip('"').strip("'") for tag in tags if str(tag).strip()]
+
+
+async def migrate_legacy_tags(db: aiosqlite.Connection):
+    """Переносит JSON-блобы из старой таблицы tags в tag_dictionary/user_tags и удаляет её."""
+    cursor = await db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tags'")
+    if await cursor.fetchone() is None:
+        return
+
+    cursor = await db.execute("SELECT user_id, tag FROM tags WHERE user_id IS NOT NULL")
+    user_tags = {row[0]: parse_legacy_tags(row[1]) for row in await cursor.fetchall()}
+
+    names = {tag for tags in user_tags.values() for tag in tags}
+    await db.executemany("INSERT OR IGNORE INTO tag_dictionary (name) VALUES (?)", [(name,) for name in names])
+    cursor = await db.execute("SELECT id, name FROM tag_dictionary")
+    tag_ids = {row[1]: row[0] for row in await cursor.fetchall()}
+
+    await db.executemany(
+        "INSERT OR IGNORE INTO user_tags (user_id, tag_id) VALUES (?, ?)",
+        [(user_id, tag_ids[tag]) for user_id, tags in user_tags.items() for tag in tags]
+    )
+    await db.execute("DROP TABLE tags")
+
+
+# (версия, описание, шаги). Уже применённые версии не меняем — только добавляем новые в конец.
+MIGRATIONS: List[Tuple[int, str, List[Step]]] = [
+    (1, "Базовая схема и нормализованные теги", [
+        *BASE_TABLES.values(),
+        "CREATE INDEX IF NOT EXISTS idx_user_tags_tag ON user_tags (tag_id, user_id);",
+        migrate_legacy_tags,
+    ]),
+    (2, "Индексы для горячих запросов", [
+        # relevance = 1 AND team_id IS NULL: выборка на распределение и счётчики участников
+        "CREATE INDEX IF NOT EXISTS idx_users_relevance_team ON users (relevance, team_id, user_id, username);",
+        # team_id = ?: состав команды, теги команды
+        "CREATE INDEX IF NOT EXISTS idx_users_team ON users (team_id, relevance, user_id);",
+        "CREATE INDEX IF NOT EXISTS idx_teams_colors ON teams (colors);",
+    ]),
+    (3, "Кэш тегов по содержимому портфолио", [
+        # key — sha256 нормализованного текста, версии промпта и модели; tags — JSON-список
+        """
+        CREATE TABLE IF NOT EXISTS tag_cache (
+            key TEXT PRIMARY KEY,
+            tags TEXT NOT NULL,
+            mean BOOL NOT NULL,
+            model TEXT,
+            prompt_version TEXT,
+            hits INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID;
+        """,
+    ]),
+]
+
+# Запросы, которые не должны превращаться в полный проход по таблице
+HOT_QUERIES = {
+    "users_to_distribute": (PARTICIPANTS_QUERY.format(free_only="AND u.team_id IS NULL"), ()),
+    "relevant_count": ("SELECT COUNT(*) FROM users WHERE relevance = 1", ()),
+    "team_members": ("SELECT user_id FROM users WHERE team_id = ?", (1,)),
+    "team_tags": ("""
+        SELECT DISTINCT ut.tag_id FROM users u
+        JOIN user_tags ut ON ut.user_id = u.user_id
+        WHERE u.team_id = ? AND u.relevance = 1
+    """, (1,)),
+    "user_tags": ("SELECT tag_id FROM user_tags WHERE user_id = ?", (1,)),
+    "teams_by_color": ("SELECT COUNT(*) FROM teams WHERE colors = ?", ("",)),
+    "tag_cache": ("SELECT tags, mean FROM tag_cache WHERE key = ?", ("",)),
+    "user_by_id": ("SELECT user_id, username, portfolio, team_id FROM users WHERE user_id = ?", (1,)),
+}
+
+
+async def get_schema_version(db: aiosqlite.Connection) -> int:
+    cursor = await db.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return (await cursor.fetchone())[0]
+
+
+async def run_migrations(db: aiosqlite.Connection) -> int:
+    """Применяет недостающие миграции, каждую в своей транзакции. Возвращает итоговую версию."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    await db.commit()
+
+    current = await get_schema_version(db)
+    for version, name, steps in MIGRATIONS:
+        if version <= current:
+            continue
+        await db.execute("BEGIN")
+        try:
+            for step in steps:
+                if callable(step):
+                    await step(db)
+                else:
+                    await db.execute(step)
+            await db.execute("INSERT INTO schema_version (version, name) VALUES (?, ?)", (version, name))
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        current = version
+    return current
+
+
+async def explain(db: aiosqlite.Connection, query: str, params=()) -> List[str]:
+    cursor = await db.execute(f"EXPLAIN QUERY PLAN {query}", params)
+    return [row[3] for row in await cursor.fetchall()]
+
+
+async def check_query_plans(db: aiosqlite.Connection):
+    """Падает с RuntimeError, если какой-то из HOT_QUERIES выполняется полным сканированием."""
+    full_scans = []
+    for name, (query, params) in HOT_QUERIES.items():
+        for detail in await explain(db, query, params):
+            if detail.startswith("SCAN") and "USING" not in detail:
+                full_scans.append(f"{name}: {detail}")
+    if full_scans:
+        raise RuntimeError("Полное сканирование в горячих запросах:\n" + "\n".join(full_scans))
@@ -0,0 +1,120 @@
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+import tempfile
+from array import array
+from pathlib import Path
+from typing import List, Sequence, Union
+
+SNAPSHOT_MAGIC = b"DIFSNAP1"
+# magic, число пользователей, число тегов во всех списках, длина блока имён в байтах
+_HEADER = struct.Struct("<8sqqq")
+
+PARTICIPANTS_QUERY = """
+    SELECT u.user_id, u.username, ut.tag_id
+    FROM users u
+    LEFT JOIN user_tags ut ON ut.user_id = u.user_id
+    WHERE u.relevance = 1 {free_only}
+    ORDER BY u.user_id
+"""
+
+Column = Union[array, memoryview]
+
+
+class ParticipantSnapshot:
+    """Участники для распределения в колоночном виде, без портфолио.
+
+    Теги пользователя i — tag_ids[offsets[i]:offsets[i + 1]]. Колонки — array('q'), а после
+    open() — memoryview прямо поверх отображённого в память файла, без копирования.
+    """
+    __slots__ = ("user_ids", "offsets", "tag_ids", "usernames", "_mmap")
+
+    def __init__(self, user_ids: Column, offsets: Column, tag_ids: Column, usernames: List[str], _mmap=None):
+        self.user_ids = user_ids
+        self.offsets = offsets
+        self.tag_ids = tag_ids
+        self.usernames = usernames
+        self._mmap = _mmap
+
+    @classmethod
+    def load(cls, conn: sqlite3.Connection, free_only: bool = True) -> "ParticipantSnapshot":
+        """Один проход по JOIN: free_only — только relevance = 1 AND team_id IS NULL, иначе все актуальные."""
+        user_ids, offsets, tag_ids, usernames = array("q"), array("q", [0]), array("q"), []
+        query = PARTICIPANTS_QUERY.format(free_only="AND u.team_id IS NULL" if free_only else "")
+        for user_id, username, tag_id in conn.execute(query):
+            if not user_ids or user_ids[-1] != user_id:
+                if user_ids:
+                    offsets.append(len(tag_ids))
+                user_ids.append(user_id)
+                usernames.append(username or "")
+            if tag_id is not None:
+                tag_ids.append(tag_id)
+        if user_ids:
+            offsets.append(len(tag_ids))
+        return cls(user_ids, offsets, tag_ids, usernames)
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    def tags(self, i: int) -> Sequence[int]:
+        return self.tag_ids[self.offsets[i]:self.offsets[i + 1]]
+
+    def tag_lists(self) -> List[Sequence[int]]:
+        return [self.tags(i) for i in range(len(self))]
+
+    def save(self, path: Union[str, Path]):
+        """Заголовок и три колонки int64 little-endian подряд, затем имена через \\0.
+
+        Пишет во временный файл рядом и подменяет им старый через os.replace: уже открытые
+        через mmap снимки продолжают видеть прежний файл целиком.
+        """
+        path = Path(path)
+        names = "\0".join(self.usernames).encode("utf-8")
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_HEADER.pack(SNAPSHOT_MAGIC, len(self.user_ids), len(self.tag_ids), len(names)))
+                for column in (self.user_ids, self.offsets, self.tag_ids):
+                    data = array("q", column)
+                    if sys.byteorder == "big":
+                        data.byteswap()
+                    f.write(data.tobytes())
+                f.write(names)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def open(cls, path: Union[str, Path]) -> "ParticipantSnapshot":
+        """Открывает файл save() через mmap: колонки читаются с диска по мере обращения."""
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, num_users, num_tags, names_size = _HEADER.unpack_from(mapped)
+        if magic != SNAPSHOT_MAGIC:
+            mapped.close()
+            raise ValueError(f"{path}: не файл снимка участников")
+
+        view = memoryview(mapped)
+        position = _HEADER.size
+        columns = []
+        for length in (num_users, num_users + 1, num_tags):
+            column = view[position:position + length * 8].cast("q")
+            if sys.byteorder == "big":
+                column = array("q", column)
+                column.byteswap()
+            columns.append(column)
+            position += length * 8
+        names = bytes(view[position:position + names_size]).decode("utf-8")
+        usernames = names.split("\0") if num_users else []
+        return cls(*columns, usernames, _mmap=mapped)
+
+    def __getstate__(self):
+        # memoryview поверх mmap не сериализуется — в другие процессы уходят обычные массивы
+        return array("q", self.user_ids), array("q", self.offsets), array("q", self.tag_ids), self.usernames
+
+    def __setstate__(self, state):
+        self.user_ids, self.offsets, self.tag_ids, self.usernames = state
+        self._mmap = None
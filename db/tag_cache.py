@@ -0,0 +1,94 @@
+import hashlib
+import json
+import re
+import unicodedata
+from collections import Counter
+from db.db import connection
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# Счётчики с момента запуска процесса; размер берётся из таблицы
+_stats = {"hits": 0, "misses": 0}
+# Попадания по ключам, ещё не записанные в tag_cache.hits: попадание — только чтение,
+# счётчики пишутся пачкой раз в TAG_CACHE_HITS_FLUSH попаданий, в /cache_stats и при остановке
+_pending_hits: Counter = Counter()
+TAG_CACHE_HITS_FLUSH = 100
+
+
+def normalize_portfolio(text: str) -> str:
+    """Одинаковый по смыслу текст — одинаковая строка: NFC, без лишних пробелов и пустых строк."""
+    text = unicodedata.normalize("NFC", text)
+    lines = (re.sub(r"\s+", " ", line).strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def tag_cache_key(portfolio_text: str, prompt_version: str, model: str) -> str:
+    payload = "\0".join((prompt_version, model, normalize_portfolio(portfolio_text)))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def get_cached_tags(key: str) -> Optional[Tuple[List[str], bool]]:
+    async with connection() as db:
+        cursor = await db.execute("SELECT tags, mean FROM tag_cache WHERE key = ?", (key,))
+        row = await cursor.fetchone()
+    if row is None:
+        _stats["misses"] += 1
+        return None
+    _stats["hits"] += 1
+    _pending_hits[key] += 1
+    if sum(_pending_hits.values()) >= TAG_CACHE_HITS_FLUSH:
+        await flush_tag_cache_hits()
+    return json.loads(row[0]), bool(row[1])
+
+
+async def get_cached_tags_many(keys: List[str]) -> Dict[str, Tuple[List[str], bool]]:
+    """То же для нескольких ключей одним запросом; в результате только найденные."""
+    if not keys:
+        return {}
+    placeholders = ", ".join("?" * len(keys))
+    async with connection() as db:
+        cursor = await db.execute(f"SELECT key, tags, mean FROM tag_cache WHERE key IN ({placeholders})", keys)
+        rows = await cursor.fetchall()
+    found = {row[0]: (json.loads(row[1]), bool(row[2])) for row in rows}
+    _stats["hits"] += len(found)
+    _stats["misses"] += len(set(keys) - found.keys())
+    _pending_hits.update(found.keys())
+    if sum(_pending_hits.values()) >= TAG_CACHE_HITS_FLUSH:
+        await flush_tag_cache_hits()
+    return found
+
+
+async def flush_tag_cache_hits():
+    if not _pending_hits:
+        return
+    # Забираем до await: попадания, пришедшие во время записи, попадут в следующую пачку
+    hits = dict(_pending_hits)
+    _pending_hits.clear()
+    async with connection() as db:
+        await db.executemany("UPDATE tag_cache SET hits = hits + ? WHERE key = ?",
+                             [(count, key) for key, count in hits.items()])
+        await db.commit()
+
+
+async def put_cached_tags(key: str, tags: List[str], is_meaningful: bool, model: str, prompt_version: str):
+    async with connection() as db:
+        await db.execute(
+            "INSERT OR REPLACE INTO tag_cache (key, tags, mean, model, prompt_version) VALUES (?, ?, ?, ?, ?)",
+            (key, json.dumps(tags, ensure_ascii=False), is_meaningful, model, prompt_version)
+        )
+        await db.commit()
+
+
+async def get_tag_cache_stats() -> Dict[str, Any]:
+    await flush_tag_cache_hits()
+    async with connection() as db:
+        cursor = await db.execute("SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM tag_cache")
+        size, total_hits = await cursor.fetchone()
+    total = _stats["hits"] + _stats["misses"]
+    return {
+        "hits": _stats["hits"],
+        "misses": _stats["misses"],
+        "size": size,
+        "total_hits": total_hits,
+        "hit_rate": _stats["hits"] / total if total else 0.0,
+    }
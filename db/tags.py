@@ -1,34 +1,109 @@
 import aiosqlite
-from db.db import DB_PATH
-from typing import List
-import json
+from db.db import connection
+from typing import Dict, Iterable, List, Optional, Tuple
 
 
-async def add_tags(user_id: int, tags: list[str]):
-    tags_str = json.dumps(tags, ensure_ascii=False)  # Преобразуем список тегов в JSON-строку
+def normalize_tags(tags: Iterable[str]) -> List[str]:
+    """Убирает пробелы, пустые значения и дубликаты, сохраняя порядок."""
+    return list(dict.fromkeys(tag.strip() for tag in tags if tag and tag.strip()))
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("SELECT tag FROM tags WHERE user_id = ?", (user_id,))
-        row = await cursor.fetchone()
 
-        if row is None:
-            await db.execute("INSERT INTO tags (user_id, tag) VALUES (?, ?)", (user_id, tags_str))
-        else:
-            await db.execute("UPDATE tags SET tag = ? WHERE user_id = ?", (tags_str, user_id))
+async def ensure_tag_ids(db: aiosqlite.Connection, names: Iterable[str]) -> Dict[str, int]:
+    """Возвращает id тегов из словаря, добавляя недостающие."""
+    names = list(names)
+    if not names:
+        return {}
+
+    await db.executemany("INSERT OR IGNORE INTO tag_dictionary (name) VALUES (?)", [(name,) for name in names])
+    placeholders = ", ".join("?" * len(names))
+    cursor = await db.execute(f"SELECT id, name FROM tag_dictionary WHERE name IN ({placeholders})", names)
+    return {row[1]: row[0] for row in await cursor.fetchall()}
 
+
+async def add_tags(user_id: int, tags: list[str]):
+    """Заменяет набор тегов пользователя (пустой список удаляет все теги)."""
+    tags = normalize_tags(tags)
+
+    async with connection() as db:
+        tag_ids = await ensure_tag_ids(db, tags)
+        await db.execute("DELETE FROM user_tags WHERE user_id = ?", (user_id,))
+        await db.executemany(
+            "INSERT INTO user_tags (user_id, tag_id) VALUES (?, ?)",
+            [(user_id, tag_ids[tag]) for tag in tags]
+        )
         await db.commit()
 
 
+async def add_tags_many(user_tags: Dict[int, List[str]]):
+    """Заменяет теги сразу нескольких пользователей одной транзакцией."""
+    user_tags = {user_id: normalize_tags(tags) for user_id, tags in user_tags.items()}
+    if not user_tags:
+        return
+
+    async with connection() as db:
+        tag_ids = await ensure_tag_ids(db, {tag for tags in user_tags.values() for tag in tags})
+        await db.executemany("DELETE FROM user_tags WHERE user_id = ?", [(user_id,) for user_id in user_tags])
+        await db.executemany(
+            "INSERT INTO user_tags (user_id, tag_id) VALUES (?, ?)",
+            [(user_id, tag_ids[tag]) for user_id, tags in user_tags.items() for tag in tags]
+        )
+        await db.commit()
+
 
 async def get_all_tags() -> List[str]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("SELECT DISTINCT tag FROM tags")
+    async with connection() as db:
+        cursor = await db.execute("""
+            SELECT d.name FROM tag_dictionary d
+            WHERE EXISTS (SELECT 1 FROM user_tags ut WHERE ut.tag_id = d.id)
+            ORDER BY d.name
+        """)
         rows = await cursor.fetchall()
         return [row[0] for row in rows]
 
 
 async def get_user_tags(user_id: int) -> List[str]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("SELECT tag FROM tags WHERE user_id = ?", (user_id,))
+    async with connection() as db:
+        cursor = await db.execute("""
+            SELECT d.name FROM user_tags ut
+            JOIN tag_dictionary d ON d.id = ut.tag_id
+            WHERE ut.user_id = ?
+        """, (user_id,))
         rows = await cursor.fetchall()
         return [row[0] for row in rows]
+
+
+async def get_user_tag_ids(user_id: int) -> List[int]:
+    async with connection() as db:
+        cursor = await db.execute("SELECT tag_id FROM user_tags WHERE user_id = ?", (user_id,))
+        rows = await cursor.fetchall()
+        return [row[0] for row in rows]
+
+
+async def get_tag_names(tag_ids: Optional[Iterable[int]] = None) -> Dict[int, str]:
+    """Словарь id -> название; без аргумента возвращает весь словарь тегов."""
+    async with connection() as db:
+        if tag_ids is None:
+            cursor = await db.execute("SELECT id, name FROM tag_dictionary")
+        else:
+            tag_ids = list(tag_ids)
+            if not tag_ids:
+                return {}
+            placeholders = ", ".join("?" * len(tag_ids))
+            cursor = await db.execute(f"SELECT id, name FROM tag_dictionary WHERE id IN ({placeholders})", tag_ids)
+        return {row[0]: row[1] for row in await cursor.fetchall()}
+
+
+async def get_tag_stats(relevant_only: bool = True) -> List[Tuple[str, int]]:
+    """Сколько пользователей носит каждый тег, по убыванию популярности."""
+    relevance_filter = "WHERE u.relevance = 1" if relevant_only else ""
+    async with connection() as db:
+        cursor = await db.execute(f"""
+            SELECT d.name, COUNT(*) AS users
+            FROM user_tags ut
+            JOIN users u ON u.user_id = ut.user_id
+            JOIN tag_dictionary d ON d.id = ut.tag_id
+            {relevance_filter}
+            GROUP BY ut.tag_id
+            ORDER BY users DESC, d.name
+        """)
+        return [(row[0], row[1]) for row in await cursor.fetchall()]
@@ -1,15 +1,230 @@
 import sqlite3
-from typing import List, Dict, Any, Set
+import time
+from contextlib import contextmanager
+from typing import List, Dict, Any, Set, Tuple, Optional, Callable
 from pathlib import Path
 from collections import defaultdict, Counter
-import json
-
-DB_PATH = Path(__file__).parent.parent / "main.db"
+from db.db import DB_PATH
+from app.loger_setup import get_logger
+from db.snapshot import ParticipantSnapshot
+from services.team_logic import (
+    tag_bits, improve_placements, plan_rebalance, plan_restarts, replay_conflicts, Move, Placement, PLANNERS,
+    RestartReport, SearchReport, SweepConfig, SweepRow, run_sweep
+)
+
+logger = get_logger(__name__, level="INFO")
+
+# Колоночный снимок участников для what-if рядом с базой; повторные прогоны читают его через mmap
+WHAT_IF_SNAPSHOT_NAME = "participants.snap"
+WHAT_IF_SNAPSHOT_TTL = 600
+
+
+def fetch_team_members(conn: sqlite3.Connection) -> Dict[int, List[Tuple[int, List[int]]]]:
+    """{team_id: [(user_id, id тегов)]} актуальных участников; пустые команды тоже попадают в словарь."""
+    teams = {row[0]: [] for row in conn.execute("SELECT id FROM teams")}
+    cur = conn.execute("""
+        SELECT u.team_id, u.user_id,
+               (SELECT GROUP_CONCAT(ut.tag_id) FROM user_tags ut WHERE ut.user_id = u.user_id)
+        FROM users u
+        WHERE u.team_id IS NOT NULL AND u.relevance = 1
+        ORDER BY u.team_id, u.user_id
+    """)
+    for team_id, user_id, tag_ids in cur.fetchall():
+        if team_id in teams:
+            teams[team_id].append((user_id, [int(tag_id) for tag_id in tag_ids.split(",")] if tag_ids else []))
+    return teams
+
+
+def fetch_tag_names(conn: sqlite3.Connection) -> Dict[int, str]:
+    cur = conn.cursor()
+    cur.execute("SELECT id, name FROM tag_dictionary")
+    return {row[0]: row[1] for row in cur.fetchall()}
+
+
+def create_teams_many(conn: sqlite3.Connection, colors: List[str]) -> List[int]:
+    """Создаёт команды заданных цветов без commit; возвращает их id в том же порядке."""
+    return [conn.execute("INSERT INTO teams (colors) VALUES (?)", (color,)).lastrowid for color in colors]
+
+
+def assign_free_users_many(conn: sqlite3.Connection, assignments: List[Tuple[int, int]]) -> List[int]:
+    """Записывает пары (user_id, team_id) только тем, кто всё ещё актуален и без команды; без commit.
+
+    Возвращает user_id, которые успели измениться после чтения снимка, — их строки не тронуты.
+    """
+    skipped = []
+    for user_id, team_id in assignments:
+        cur = conn.execute(
+            "UPDATE users SET team_id = ? WHERE user_id = ? AND team_id IS NULL AND relevance = 1",
+            (team_id, user_id)
+        )
+        if cur.rowcount == 0:
+            skipped.append(user_id)
+    return skipped
+
+
+def move_users_many(conn: sqlite3.Connection, moves: List[Move]) -> List[int]:
+    """Переносы между командами только для тех, кто всё ещё актуален и в исходной команде; без commit."""
+    skipped = []
+    for move in moves:
+        cur = conn.execute(
+            "UPDATE users SET team_id = ? WHERE user_id = ? AND team_id = ? AND relevance = 1",
+            (move.target, move.user_id, move.source)
+        )
+        if cur.rowcount == 0:
+            skipped.append(move.user_id)
+    return skipped
+
+
+@contextmanager
+def read_snapshot(conn: sqlite3.Connection):
+    """Все запросы внутри видят базу на один момент времени.
+
+    Это обычная читающая транзакция: в WAL-режиме она не мешает боту писать с других соединений,
+    а после выхода снимок отпускается — расчёт идёт уже без транзакции и блокировок.
+    """
+    conn.execute("BEGIN")
+    try:
+        yield conn
+    finally:
+        conn.rollback()
+
+
+@contextmanager
+def write_transaction(conn: sqlite3.Connection):
+    """Короткая пишущая транзакция: блокировка на запись берётся сразу, ошибка внутри — откат."""
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        yield conn
+
+
+class MemberResult:
+    """Участник, размещённый в этом запуске; теги и конфликтные теги — уже названиями."""
+    __slots__ = ("user_id", "username", "tags", "conflict_tags", "overflow")
+
+    def __init__(self, user_id: int, username: str, tags: List[str], conflict_tags: List[str], overflow: bool):
+        self.user_id = user_id
+        self.username = username
+        self.tags = tags
+        self.conflict_tags = conflict_tags
+        self.overflow = overflow
+
+
+class TeamResult:
+    """Команда после распределения. members — только новые участники, size — вместе с прежними."""
+    __slots__ = ("id", "color", "size", "members")
+
+    def __init__(self, team_id: Optional[int], color: str, size: int, members: List[MemberResult]):
+        self.id = team_id
+        self.color = color
+        self.size = size
+        self.members = members
+
+    @property
+    def conflict_users(self) -> int:
+        return sum(1 for member in self.members if member.conflict_tags)
+
+    @property
+    def conflict_tags(self) -> Counter:
+        return Counter(tag for member in self.members for tag in member.conflict_tags)
+
+
+class DistributionResult:
+    """Итог распределения: команды в порядке планировщика, неразмещённые и отчёты оптимизаций.
+
+    skipped — user_id, которые изменились в базе, пока шёл расчёт (деактивированы или уже
+    в команде); их назначение не записано, и в teams их нет.
+    """
+    __slots__ = ("teams", "unplaced", "dry_run", "search", "restarts", "skipped")
+
+    def __init__(self, teams: List[TeamResult], unplaced: List[MemberResult], dry_run: bool,
+                 search: Optional[SearchReport] = None, restarts: Optional[RestartReport] = None,
+                 skipped: Optional[List[int]] = None):
+        self.teams = teams
+        self.unplaced = unplaced
+        self.dry_run = dry_run
+        self.search = search
+        self.restarts = restarts
+        self.skipped = skipped or []
+
+    @classmethod
+    def build(cls, participants: ParticipantSnapshot, teams: List[Dict], placements: List[Optional[Placement]],
+              tag_names: Dict[int, str], dry_run: bool, search: Optional[SearchReport] = None,
+              restarts: Optional[RestartReport] = None,
+              skipped: Optional[List[int]] = None) -> "DistributionResult":
+        skipped_ids = set(skipped or ())
+        team_results = [TeamResult(team["id"], team["color"], team["members"], []) for team in teams]
+        unplaced = []
+        user_tags = participants.tag_lists()
+        conflict_masks = replay_conflicts(user_tags, teams, placements)
+        for i, (placement, conflict_mask) in enumerate(zip(placements, conflict_masks)):
+            member = MemberResult(
+                participants.user_ids[i], participants.usernames[i] or "",
+                [tag_names.get(tag, str(tag)) for tag in user_tags[i]],
+                [tag_names.get(tag, str(tag)) for tag in tag_bits.decode(conflict_mask)],
+                placement is not None and placement.overflow,
+            )
+            if placement is None:
+                unplaced.append(member)
+            elif member.user_id in skipped_ids:
+                team_results[placement.team].size -= 1
+            else:
+                team_results[placement.team].members.append(member)
+        return cls(team_results, unplaced, dry_run, search, restarts, skipped)
+
+    @property
+    def assigned(self) -> int:
+        return sum(len(team.members) for team in self.teams)
+
+    @property
+    def conflict_tags(self) -> Counter:
+        total = Counter()
+        for team in self.teams:
+            total.update(team.conflict_tags)
+        return total
+
+    @property
+    def total_conflicts(self) -> int:
+        return sum(self.conflict_tags.values())
+
+    def joined(self) -> Dict[int, List[int]]:
+        """{team_id: [user_id]} команд, получивших участников в этом запуске."""
+        return {team.id: [member.user_id for member in team.members] for team in self.teams if team.members}
+
+    def log_lines(self) -> List[str]:
+        """Текстовый отчёт для консоли."""
+        lines = []
+        for team in self.teams:
+            team_name = f"#{team.id}" if team.id is not None else "(новая)"
+            for member in team.members:
+                status = []
+                if member.overflow:
+                    status.append("🟡 переполнение")
+                if member.conflict_tags:
+                    status.append(f"⚠️ конфликт тегов: {', '.join(member.conflict_tags)}")
+                lines.append(f"{member.user_id} | {member.username} | {', '.join(member.tags)} | "
+                             f"команда {team_name} ({team.color}) {' + '.join(status) or '✅ OK'}")
+        lines.extend(f"{member.user_id} | {member.username} | ❌ Нет доступных команд" for member in self.unplaced)
+        if self.skipped:
+            lines.append(f"Пропущено (изменились во время расчёта): {self.skipped}")
+
+        lines.append(f"📊 Распределено: {self.assigned}, без команды: {len(self.unplaced)}, "
+                     f"конфликтов тегов: {self.total_conflicts}")
+        most_common = self.conflict_tags.most_common(3)
+        if most_common:
+            lines.append("  Топ-3 конфликтных тегов: " + ", ".join(f"{tag} ({count})" for tag, count in most_common))
+        if self.restarts:
+            lines.append(f"Прогонов: {self.restarts.runs}, лучший seed {self.restarts.best_seed}, "
+                         f"конфликты по прогонам: {self.restarts.conflicts}")
+        if self.search:
+            lines.append(f"Локальный поиск: конфликтов {self.search.conflicts_before} -> "
+                         f"{self.search.conflicts_after}, переносов {self.search.moves}, "
+                         f"обменов {self.search.swaps} за {self.search.elapsed:.1f} с")
+        return lines
 
 
 class TeamDistributor:
-    def __init__(self):
-        self.conn = sqlite3.connect(DB_PATH)
+    def __init__(self, db_path: Optional[str] = None):
+        self.conn = sqlite3.connect(db_path or DB_PATH)
         self.conn.row_factory = sqlite3.Row
         self.color_limits = {}  # color -> max number of teams with that color
 
@@ -19,35 +234,19 @@ class TeamDistributor:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.conn.close()
 
-    def setup_colors(self, color_limits: Dict[str, int]):
-        """Инициализирует команды и лимиты по цветам."""
+    def setup_colors(self, color_limits: Dict[str, int], reset: bool = True):
+        """Инициализирует команды и лимиты по цветам. reset=False — только лимиты, команды остаются."""
         self.color_limits = color_limits
+        if not reset:
+            return
         with self.conn:
             self.conn.execute("DELETE FROM teams")
-            for color, limit in color_limits.items():
-                if limit > 0:  # Создаём команды только для цветов с положительным лимитом
-                    for _ in range(limit):
-                        self.conn.execute("INSERT INTO teams (colors) VALUES (?)", (color,))
+            # Создаём команды только для цветов с положительным лимитом
+            create_teams_many(self.conn, [color for color, limit in color_limits.items() for _ in range(max(limit, 0))])
 
-    def get_users_to_distribute(self) -> List[Dict]:
-        cur = self.conn.cursor()
-        cur.execute("""
-            SELECT u.user_id, u.username, u.portfolio, 
-                   (SELECT GROUP_CONCAT(t.tag) 
-                    FROM tags t 
-                    WHERE t.user_id = u.user_id) as tags
-            FROM users u
-            WHERE u.relevance = 1 AND u.team_id IS NULL
-        """)
-        return [
-            {
-                "user_id": row["user_id"],
-                "username": row["username"],
-                "portfolio": row["portfolio"],
-                "tags": json.loads(row["tags"]) if row["tags"] else []
-            }
-            for row in cur.fetchall()
-        ]
+    def get_users_to_distribute(self) -> ParticipantSnapshot:
+        """Свободные актуальные пользователи колонками (user_id, username, теги) — без портфолио, одним проходом."""
+        return ParticipantSnapshot.load(self.conn)
 
     def get_team_stats(self) -> List[Dict[str, Any]]:
         cur = self.conn.cursor()
@@ -67,16 +266,31 @@ class TeamDistributor:
             for row in cur.fetchall()
         ]
 
-    def get_team_tags(self, team_id: int) -> Set[str]:
-        """Возвращает множество тегов пользователей команды."""
+    def get_team_tags(self, team_id: int) -> Set[int]:
+        """Возвращает множество id тегов пользователей команды."""
         cur = self.conn.cursor()
         cur.execute("""
-            SELECT t.tag FROM tags t
-            JOIN users u ON t.user_id = u.user_id
+            SELECT DISTINCT ut.tag_id FROM users u
+            JOIN user_tags ut ON ut.user_id = u.user_id
             WHERE u.team_id = ? AND u.relevance = 1
         """, (team_id,))
-        tags = {row["tag"] for row in cur.fetchall()}
-        return tags
+        return {row["tag_id"] for row in cur.fetchall()}
+
+    def get_all_team_tags(self) -> Dict[int, Set[int]]:
+        """Множества id тегов всех укомплектованных команд одним запросом."""
+        cur = self.conn.cursor()
+        cur.execute("""
+            SELECT DISTINCT u.team_id, ut.tag_id FROM users u
+            JOIN user_tags ut ON ut.user_id = u.user_id
+            WHERE u.team_id IS NOT NULL AND u.relevance = 1
+        """)
+        team_tags = defaultdict(set)
+        for row in cur.fetchall():
+            team_tags[row["team_id"]].add(row["tag_id"])
+        return team_tags
+
+    def get_tag_names(self) -> Dict[int, str]:
+        return fetch_tag_names(self.conn)
 
     def get_color_team_count(self, color: str) -> int:
         """Возвращает количество команд с заданным цветом."""
@@ -84,116 +298,97 @@ class TeamDistributor:
         cur.execute("SELECT COUNT(*) FROM teams WHERE colors = ?", (color,))
         return cur.fetchone()[0]
 
-    def distribute_users(self, max_team_size: int = 10):
-        """Распределяет пользователей по командам с учетом их тегов и ограничений"""
-        users = self.get_users_to_distribute()
-        teams = self.get_team_stats()
-
-        # Инициализация команд (только цвета с положительным лимитом)
-        if not teams:
-            with self.conn:
-                for color, limit in self.color_limits.items():
-                    if limit > 0:
-                        for _ in range(limit):
-                            self.conn.execute("INSERT INTO teams (colors) VALUES (?)", (color,))
-            teams = self.get_team_stats()
-
-        # Собираем теги для каждой команды
-        team_tags = {team["id"]: set(self.get_team_tags(team["id"])) for team in teams}
-
-        output = []
-
-        for user in users:
-            user_tags = set(user["tags"])
-            best_team = None
-            min_conflicts = float('inf')
-            min_members = float('inf')
-
-            # 1. Ищем команду без конфликтов (со свободными местами)
-            for team in teams:
-                if team["members"] < max_team_size and team_tags[team["id"]].isdisjoint(user_tags):
-                    best_team = team
-                    break
-
-            # 2. Ищем команду с минимальными конфликтами (со свободными местами)
-            if not best_team:
-                for team in teams:
-                    if team["members"] >= max_team_size:
-                        continue
-
-                    conflicts = len(team_tags[team["id"]].intersection(user_tags))
-                    if conflicts < min_conflicts or (conflicts == min_conflicts and team["members"] < min_members):
-                        best_team = team
-                        min_conflicts = conflicts
-                        min_members = team["members"]
-
-            # 3. Если все команды переполнены, ищем любую с минимальными конфликтами
-            if not best_team:
-                # Фильтруем только команды с положительным лимитом цвета
-                eligible_teams = [t for t in teams if self.color_limits.get(t["color"], 0) > 0]
-                if eligible_teams:
-                    best_team = min(
-                        eligible_teams,
-                        key=lambda x: (
-                            len(team_tags[x["id"]].intersection(user_tags)),
-                            x["members"]
-                        )
-                    )
-
-            # 4. Если можно создать новую команду (по лимиту цвета)
-            if not best_team or best_team["members"] >= max_team_size:
-                # Находим цвет с наименьшим количеством команд (но в пределах лимита)
-                color_counts = {}
+    def distribute_users(self, max_team_size: int = 10,
+                         progress: Optional[Callable[[int, int], None]] = None,
+                         mode: str = "indexed", optimize_seconds: float = 0.0, restarts: int = 1,
+                         dry_run: bool = False, teams: Optional[List[Dict[str, Any]]] = None) -> "DistributionResult":
+        """Распределяет пользователей по командам с учетом их тегов и ограничений.
+
+        mode: "indexed" — поиск команды по куче TeamRegistry (по умолчанию), "greedy" —
+        поштучный перебор команд, "vectorized" — тот же перебор с матричным подсчётом
+        конфликтов через numpy (результат совпадает с "greedy"), "sharded" — цвета
+        распределяются параллельно в отдельных процессах и сшиваются локальным поиском.
+        progress(обработано, всего) вызывается примерно на каждые 5% пользователей.
+        optimize_seconds > 0 — после планировщика до стольких секунд локального поиска
+        (переносы и обмены).
+        restarts > 1 — столько прогонов с разным порядком пользователей в пуле процессов,
+        берётся лучший.
+        dry_run — ничего не писать в базу: новые команды остаются с id None.
+        teams — свои команды вместо команд из базы (словари с "id", "color", "members", "tags").
+        """
+        planner = PLANNERS[mode]
+        restart_report: Optional[RestartReport] = None
+        search: Optional[SearchReport] = None
+        skipped: List[int] = []
+
+        # Участники, теги и команды читаются из одного снимка, пока бот продолжает писать
+        with read_snapshot(self.conn):
+            participants = self.get_users_to_distribute()
+            tag_names = self.get_tag_names()
+            if teams is None:
+                teams = self.get_team_stats()
+                # Собираем теги для каждой команды
+                all_team_tags = self.get_all_team_tags()
                 for team in teams:
-                    color = team["color"]
-                    if self.color_limits.get(color, 0) > 0:
-                        color_counts[color] = color_counts.get(color, 0) + 1
-
-                available_colors = [color for color, limit in self.color_limits.items()
-                                    if limit > 0 and color_counts.get(color, 0) < limit]
-
-                if available_colors:
-                    color = min(available_colors, key=lambda c: color_counts.get(c, 0))
-                    with self.conn:
-                        self.conn.execute("INSERT INTO teams (colors) VALUES (?)", (color,))
-                        new_team_id = self.conn.execute("SELECT last_insert_rowid()").fetchone()[0]
-                    new_team = {"id": new_team_id, "color": color, "members": 0}
-                    teams.append(new_team)
-                    team_tags[new_team_id] = set()
-                    best_team = new_team
-
-            if not best_team:
-                output.append(f"{user['user_id']} | {user.get('username', '')} | ❌ Нет доступных команд")
-                continue
-
-            # Проверяем конфликты для логов
-            status = []
-            if best_team["members"] >= max_team_size:
-                status.append("🟡 переполнение")
-            if not team_tags[best_team["id"]].isdisjoint(user_tags):
-                status.append("⚠️ конфликт тегов")
-            if not status:
-                status.append("✅ OK")
-
-            # Обновляем данные в БД
-            with self.conn:
-                self.conn.execute(
-                    "UPDATE users SET team_id = ? WHERE user_id = ?",
-                    (best_team["id"], user["user_id"])
-                )
-
-            # Обновляем теги и счетчики
-            team_tags[best_team["id"]].update(user_tags)
-            best_team["members"] += 1
-
-            # Формируем строку лога
-            output.append(
-                f"{user['user_id']} | {user.get('username', '')} | {user['tags']} | "
-                f"команда #{best_team['id']} ({best_team['color']}) {' + '.join(status)}"
-            )
+                    team["tags"] = all_team_tags.get(team["id"], ())
 
-        for log_line in output:
-            print(log_line)
+        if not teams:
+            # Инициализация команд (только цвета с положительным лимитом); создаются вместе с распределением
+            teams = [{"id": None, "color": color, "members": 0, "tags": ()}
+                     for color, limit in self.color_limits.items() for _ in range(max(limit, 0))]
+
+        # Планировщики читают теги прямо из колонок снимка, без словаря на пользователя
+        user_tags = participants.tag_lists()
+        if restarts > 1:
+            placements, restart_report = plan_restarts(user_tags, teams, self.color_limits, max_team_size, restarts,
+                                                       mode, optimize_seconds, progress=progress)
+            search = restart_report.search
+        else:
+            placements = planner(user_tags, teams, self.color_limits, max_team_size, progress)
+            if optimize_seconds > 0:
+                placements, search = improve_placements(user_tags, teams, placements, max_team_size, optimize_seconds)
+
+        if not dry_run:
+            # Всё распределение (новые команды и team_id) пишется одной короткой транзакцией.
+            # Кого успели деактивировать или посадить за время расчёта — пропускаем, а не перезаписываем
+            with write_transaction(self.conn):
+                existing = {row[0] for row in self.conn.execute("SELECT id FROM teams")}
+                removed = [team["id"] for team in teams if team["id"] is not None and team["id"] not in existing]
+                if removed:
+                    raise RuntimeError(f"Команды удалены во время распределения: {removed}")
+
+                new_teams = [team for team in teams if team["id"] is None]
+                for team, team_id in zip(new_teams, create_teams_many(self.conn, [t["color"] for t in new_teams])):
+                    team["id"] = team_id
+                skipped = assign_free_users_many(self.conn, [
+                    (user_id, teams[placement.team]["id"])
+                    for user_id, placement in zip(participants.user_ids, placements) if placement is not None
+                ])
+
+        result = DistributionResult.build(participants, teams, placements, tag_names, dry_run, search, restart_report,
+                                          skipped)
+        if not dry_run:
+            for log_line in result.log_lines():
+                print(log_line)
+        return result
+
+    def rebalance_teams(self, max_team_size: int = 10) -> List[Move]:
+        """Выравнивает размеры команд после выбывания участников минимальным числом переносов.
+
+        Пишет только изменившиеся users.team_id одной транзакцией, возвращает сделанные переносы;
+        участники, сменившие команду или статус во время расчёта, не переносятся.
+        """
+        with read_snapshot(self.conn):
+            members = fetch_team_members(self.conn)
+        moves = plan_rebalance(members, max_team_size)
+        with write_transaction(self.conn):
+            skipped = set(move_users_many(self.conn, moves))
+        moves = [move for move in moves if move.user_id not in skipped]
+        for move in moves:
+            logger.info(f"{move.user_id}: команда #{move.source} -> #{move.target}")
+        if skipped:
+            logger.warning(f"Пропущено (изменились во время расчёта): {sorted(skipped)}")
+        return moves
 
     def clear_all_teams(self):
         """Удаляет все команды и обнуляет team_id у всех пользователей"""
@@ -203,133 +398,76 @@ class TeamDistributor:
 
 
 
-class TestTeamDistributor:
-    def __init__(self, db_path: str = DB_PATH):
-        self.conn = sqlite3.connect(db_path)
-        self.conn.row_factory = sqlite3.Row
-        self.num_teams = 5
+def run_distribution(color_limits: Dict[str, int], max_team_size: int,
+                     progress: Optional[Callable[[int, int], None]] = None, mode: str = "indexed",
+                     optimize_seconds: float = 0.0, restarts: int = 1) -> DistributionResult:
+    """Полный цикл распределения на собственном соединении — для запуска в пуле потоков."""
+    with TeamDistributor() as distributor:
+        distributor.setup_colors(color_limits)
+        return distributor.distribute_users(max_team_size=max_team_size, progress=progress, mode=mode,
+                                            optimize_seconds=optimize_seconds, restarts=restarts)
 
-    def __enter__(self):
-        return self
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self.conn.close()
+def run_late_joiners(color_limits: Dict[str, int], max_team_size: int) -> Dict[int, List[int]]:
+    """Досаживает в существующие команды только relevance = 1 AND team_id IS NULL, остальных не трогает.
 
-    # noinspection PyBroadException
-    def get_users_to_distribute(self) -> List[Dict]:
-        cur = self.conn.cursor()
-        cur.execute("""
-            SELECT u.user_id, u.username, u.portfolio, 
-                   (SELECT GROUP_CONCAT(t.tag) 
-                    FROM tags t 
-                    WHERE t.user_id = u.user_id) as tags
-            FROM users u
-            WHERE u.relevance = 1 AND u.team_id IS NULL
-        """)
-        users = []
-        for row in cur.fetchall():
-            raw_tags = row["tags"]
-            if raw_tags:
-                try:
-                    tags = json.loads(raw_tags)
-                except Exception:
-                    tags = [tag.strip().strip('"').strip("'") for tag in raw_tags.split(",")]
-            else:
-                tags = []
-            users.append({
-                "user_id": row["user_id"],
-                "username": row["username"],
-                "portfolio": row["portfolio"],
-                "tags": tags,
-            })
-        return users
-
-    @staticmethod
-    def format_user_log(user_id, username, tags, conflict_tags):
-        tags_str = ", ".join(tags)
-        if conflict_tags:
-            conflicts_str = ", ".join(conflict_tags)
-            status = f"Конфликт: {conflicts_str}"
-        else:
-            status = "OK"
-        return f"{user_id} | {username} | {tags_str} | {status}"
+    Теги команд собираются одним запросом по индексам, каждый новичок размещается через
+    TeamRegistry за O(log команд); новые команды создаются, только если все полны и лимит цвета позволяет.
+    Возвращает {team_id: [user_id новичков]} — только затронутые команды.
+    """
+    with TeamDistributor() as distributor:
+        distributor.setup_colors(color_limits, reset=False)
+        return distributor.distribute_users(max_team_size=max_team_size, mode="indexed").joined()
 
-    def simulate_distribution(self, max_team_size: int = 10) -> List[str]:
-        users = self.get_users_to_distribute()
 
-        teams = [
-            {"id": i + 1, "members": 0, "tags": set(), "logs": [], "conflict_users": 0,
-             "conflict_tags_counter": Counter()}
-            for i in range(self.num_teams)
-        ]
+def run_rebalance(max_team_size: int) -> List[Move]:
+    with TeamDistributor() as distributor:
+        return distributor.rebalance_teams(max_team_size)
 
-        distribution_log = []
-        conflict_tag_counter = Counter()
-
-        for user in users:
-            user_tags = set(user["tags"])
-            best_team = None
-            min_conflicts = float("inf")
-            min_members = float("inf")
-
-            for team in teams:
-                if team["members"] >= max_team_size:
-                    continue
-                conflicts = team["tags"].intersection(user_tags)
-                num_conflicts = len(conflicts)
-                if num_conflicts == 0:
-                    best_team = team
-                    min_conflicts = 0
-                    break
-                elif num_conflicts < min_conflicts or (
-                        num_conflicts == min_conflicts and team["members"] < min_members):
-                    best_team = team
-                    min_conflicts = num_conflicts
-                    min_members = team["members"]
-
-            if not best_team:
-                distribution_log.append(f"❌ {user['user_id']} | {user.get('username', '')} | Нет подходящей команды")
-                continue
-
-            conflicting_tags = best_team["tags"].intersection(user_tags)
-            if conflicting_tags:
-                best_team["conflict_users"] += 1
-                best_team["conflict_tags_counter"].update(conflicting_tags)
-                conflict_tag_counter.update(conflicting_tags)
-
-            best_team["members"] += 1
-            best_team["tags"].update(user_tags)
-            log = TestTeamDistributor.format_user_log(user["user_id"], user.get("username", ""), user["tags"], conflicting_tags)
-            best_team["logs"].append(log)
-
-        result_team = []
-        for team in teams:
-            result_team.append(
-                f"\n🟢 Команда #{team['id']} ({team['members']} участников, {team['conflict_users']} с конфликтами)")
-            result_team.extend(f"  {log}" for log in team["logs"])
-
-            # Статистика по команде
-            if team["conflict_tags_counter"]:
-                common_tags = team["conflict_tags_counter"].most_common(3)
-                conflict_tags_summary = ", ".join(f"{tag}({count})" for tag, count in common_tags)
-                result_team.append(f"  Конфликтные теги в команде: {conflict_tags_summary}")
-
-        for log in distribution_log:
-            result_team.append(log)
-
-        # Общая статистика конфликтов
-        result_team.append("\n📊 Общая статистика конфликтов:")
-        total_conflicts = sum(conflict_tag_counter.values())
-        if total_conflicts:
-            most_common = conflict_tag_counter.most_common(3)
-            tags_summary = ", ".join(f"{tag} ({count})" for tag, count in most_common)
-            result.append(f"  Всего конфликтов: {total_conflicts}")
-            result.append(f"  Топ-3 конфликтных тегов: {tags_summary}")
-            result.append(f"\n  Самый конфликтный тег: '{most_common[0][0]}' с {most_common[0][1]} пересечениями")
-        else:
-            result_team.append("  Конфликтных тегов не обнаружено")
 
-        return result_team
+def load_what_if_snapshot(refresh: bool = False) -> ParticipantSnapshot:
+    """Все актуальные участники для what-if: из файла WHAT_IF_SNAPSHOT_PATH, если он свежее
+    WHAT_IF_SNAPSHOT_TTL секунд, иначе из базы (только чтение) с перезаписью файла."""
+    path = Path(DB_PATH).with_name(WHAT_IF_SNAPSHOT_NAME)
+    if not refresh and path.exists() and time.time() - path.stat().st_mtime < WHAT_IF_SNAPSHOT_TTL:
+        return ParticipantSnapshot.open(path)
+
+    conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+    try:
+        with read_snapshot(conn):
+            snapshot = ParticipantSnapshot.load(conn, free_only=False)
+    finally:
+        conn.close()
+    snapshot.save(path)
+    return snapshot
+
+
+def run_what_if(configs: List[SweepConfig], workers: Optional[int] = None, refresh: bool = False) -> List[SweepRow]:
+    """Сравнивает конфигурации распределения с нуля по одному снимку актуальных участников.
+
+    main.db открывается только на чтение и не меняется; расчёт идёт в пуле процессов.
+    """
+    return run_sweep(load_what_if_snapshot(refresh), configs, workers)
+
+
+def run_clear_teams():
+    with TeamDistributor() as distributor:
+        distributor.clear_all_teams()
+
+
+class TestTeamDistributor(TeamDistributor):
+    """Пробное распределение по num_teams пустым командам без записи в базу (тот же движок, dry_run)."""
+
+    def __init__(self, db_path: str = None):
+        super().__init__(db_path)
+        self.num_teams = 5
+
+    def simulate_distribution(self, max_team_size: int = 10, optimize_seconds: float = 0.0,
+                              mode: str = "greedy") -> DistributionResult:
+        # Без лимитов цветов новые команды не создаются, а лишние участники остаются без команды
+        teams = [{"id": i + 1, "color": "", "members": 0, "tags": ()} for i in range(self.num_teams)]
+        return self.distribute_users(max_team_size=max_team_size, mode=mode, optimize_seconds=optimize_seconds,
+                                     dry_run=True, teams=teams)
 
 
 if __name__ == "__main__":
@@ -337,5 +475,5 @@ if __name__ == "__main__":
     with TestTeamDistributor() as distributor:
         distributor.num_teams = 5
         result = distributor.simulate_distribution(max_team_size=5)
-        for line in result:
+        for line in result.log_lines():
             print(line)
@@ -1,22 +1,40 @@
-import aiosqlite
-from db.db import DB_PATH
+from db.db import connection
+from db.cache import TTLCache
 from db.models import User
-from typing import Optional, List
+from typing import Any, Dict, Optional, List
 from app.loger_setup import get_logger
 
 
 logger = get_logger(__name__, level="INFO")
 
+USER_CACHE_SIZE = 2048
+USER_CACHE_TTL = 600.0
+
+# Профили по user_id; записи через функции этого модуля обновляют кэш сразу после commit
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+
+def _write_through(user_id: int, **fields):
+    user_cache.touch(user_id)
+    user = user_cache.peek(user_id)
+    if user is not None:
+        user_cache.set(user_id, user.model_copy(update=fields))
+
+
+def get_user_cache_stats() -> Dict[str, Any]:
+    return user_cache.stats()
+
 
 async def update_user_username(user_id: int, username: str):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with connection() as db:
         await db.execute("UPDATE users SET username = ? WHERE user_id = ?", (username, user_id))
         await db.commit()
+    _write_through(user_id, username=username)
 
 
 async def add_user(user: User):
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
+        async with connection() as db:
             user_data = user.model_dump()
 
             await db.execute(
@@ -24,17 +42,27 @@ async def add_user(user: User):
                 (user_data['user_id'], user_data['username'], user_data['portfolio'], user_data['team_id'])
             )
             await db.commit()
+        user_cache.invalidate(user.user_id)
     except Exception as e:
         logger.error(f"Error adding user: {e}")
 
 
 async def get_user(user_id: int) -> Optional[User]:
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+
+    # Запись, закоммиченная пока идёт чтение, меняет версию — тогда прочитанное в кэш не кладём
+    version = user_cache.version(user_id)
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
+        async with connection() as db:
             cursor = await db.execute("SELECT user_id, username, portfolio, team_id FROM users WHERE user_id = ?",
                                       (user_id,))
             row = await cursor.fetchone()
-            return User(**dict(zip([column[0] for column in cursor.description], row))) if row else None
+            user = User(**dict(zip([column[0] for column in cursor.description], row))) if row else None
+        if user is not None:
+            user_cache.set_if_unchanged(user_id, user, version)
+        return user
     except Exception as e:
         logger.error(f"Error getting user {user_id}: {e}")
         return None
@@ -42,37 +70,32 @@ async def get_user(user_id: int) -> Optional[User]:
 
 async def delete_user_portfolio(user_id: int):
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
+        async with connection() as db:
             await db.execute("UPDATE users SET portfolio = '' WHERE user_id = ?", (user_id,))
             await db.commit()
+        _write_through(user_id, portfolio="")
     except Exception as e:
         logger.error(f"Error deleting portfolio for user {user_id}: {e}")
 
 
-async def get_user_portfolio(user_id: int) -> Optional[User]:
-    try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute("SELECT portfolio FROM users WHERE user_id = ?",
-                                      (user_id,))
-            row = await cursor.fetchone()
-            return row[0] if row else None
-    except Exception as e:
-        logger.error(f"Error getting user {user_id}: {e}")
-        return None
+async def get_user_portfolio(user_id: int) -> Optional[str]:
+    user = await get_user(user_id)
+    return user.portfolio if user else None
 
 
 async def update_user_team(user_id: int, team_id: int):
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
+        async with connection() as db:
             await db.execute("UPDATE users SET team_id = ? WHERE user_id = ?", (team_id, user_id))
             await db.commit()
+        _write_through(user_id, team_id=team_id)
     except Exception as e:
         logger.error(f"Error updating user team {user_id}: {e}")
 
 
 async def get_all_users() -> List[User]:
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
+        async with connection() as db:
             cursor = await db.execute("SELECT user_id, username, portfolio, team_id FROM users")
             rows = await cursor.fetchall()
             return [User(**dict(zip([column[0] for column in cursor.description], row))) for row in rows]
@@ -83,22 +106,23 @@ async def get_all_users() -> List[User]:
 
 async def update_user_portfolio(user_id: int, portfolio: str):
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
+        async with connection() as db:
             await db.execute("UPDATE users SET portfolio = ? WHERE user_id = ?", (portfolio, user_id))
             await db.commit()
+        _write_through(user_id, portfolio=portfolio)
     except Exception as e:
         logger.error(f"Error updating user portfolio {user_id}: {e}")
 
 
 async def set_relevance_true_by_user_id(user_id: int):
-    async with aiosqlite.connect("main.db") as db:
+    async with connection() as db:
         await db.execute(
             "UPDATE users SET relevance = 1 WHERE user_id = ?", (user_id,)
         )
         await db.commit()
 
 async def activate_all_users():
-    async with aiosqlite.connect("main.db") as db:
+    async with connection() as db:
         await db.execute("""
             UPDATE users
             SET relevance = 1
@@ -107,13 +131,13 @@ async def activate_all_users():
         await db.commit()
 
 async def deactivate_all_users():
-    async with aiosqlite.connect("main.db") as db:
+    async with connection() as db:
         await db.execute("UPDATE users SET relevance = 0")
         await db.commit()
 
 
 async def get_relevant_users_without_tags():
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with connection() as db:
         cursor = await db.execute("""
             SELECT u.id, u.user_id, u.username, u.portfolio, u.team_id 
             FROM users u
@@ -1,16 +1,17 @@
 from aiogram import types, Dispatcher
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from aiogram.dispatcher import FSMContext
-from aiogram.dispatcher.filters import BoundFilter
 from app.config import bot
-from db.admin import get_admin_user_ids
-from db.admin import get_relevant_users_with_tags
-from db.users import get_relevant_users_without_tags, activate_all_users, deactivate_all_users
-from db.tags import add_tags
+from db.admin import count_relevant_users
+from db.users import get_relevant_users_without_tags, activate_all_users, deactivate_all_users, get_user_cache_stats
+from db.tags import add_tags_many
+from db.tag_cache import get_tag_cache_stats
 from aiogram.utils.markdown import escape_md
-from services.local_AI import generate_text
+from services.llm_router import get_router_stats
+from services.tagging import PROMPT_BATCH_SIZE, extract_tags_batch, update_known_tags
 import secrets
 import asyncio
+import time
 import json
 from pathlib import Path
 import os
@@ -25,24 +26,7 @@ load_dotenv()
 SPECIAL_ADMIN_CODE = os.getenv("SPECIAL_ADMIN_CODE")
 
 
-class IsAdminFilter(BoundFilter):
-    key = 'is_admin'
-
-    def __init__(self, is_admin):
-        self.is_admin = is_admin
-
-    async def check(self, message: types.Message):
-        admin_ids = await get_admin_user_ids()
-        return message.from_user.id in admin_ids
-
-
-def register_filters(dp: Dispatcher):
-    dp.filters_factory.bind(IsAdminFilter)
-
-
 async def activate_all(message: types.Message):
-    if message.from_user.id not in await get_admin_user_ids():
-        return
     await activate_all_users()
 
     await message.answer("✅ Все пользователи активированы (relevance = 1)")
@@ -50,43 +34,18 @@ async def activate_all(message: types.Message):
 
 
 async def deactivate_all(message: types.Message):
-    if message.from_user.id not in await get_admin_user_ids():
-        return
-
     await deactivate_all_users()
 
     await message.answer("✅ Все пользователи деактивированы (relevance = 0)")
     logger.info("✅ Все пользователи деактивированы (relevance = 0)")
 
 
-def load_known_tags():
-    if not os.path.exists("known_tags.json"):
-        return []
-    with open("known_tags.json", "r", encoding="utf-8") as f:
-        return json.load(f)
-
-
-def save_known_tags(tags: list[str]):
-    with open("known_tags.json", "w", encoding="utf-8") as f:
-        json.dump(sorted(set(tags)), f, ensure_ascii=False, indent=2)
-
-
-def update_known_tags(new_tags: list[str]):
-    known = set(load_known_tags())
-    updated = known.union(new_tags)
-    save_known_tags(list(updated))
-
-
 def load_prompt(key: str, path="prompts.json") -> str:
     with open(path, "r", encoding="utf-8") as f:
         prompts = json.load(f)
     return prompts[key]
 
 async def generate_admin_link(message: types.Message):
-    user_id = message.from_user.id
-    if not user_id in await get_admin_user_ids():
-        return
-
     # Формируем ссылку с SPECIAL_ADMIN_CODE
     bot_username = (await message.bot.get_me()).username
     admin_link = f"https://t.me/{bot_username}?start={SPECIAL_ADMIN_CODE}"
@@ -97,12 +56,7 @@ async def generate_admin_link(message: types.Message):
         parse_mode="MarkdownV2"
     )
 async def handle_admin(message: types.Message, state: FSMContext):
-    user_id = message.from_user.id
-    if not user_id in await get_admin_user_ids():
-        return
-
-    relevant_users = await get_relevant_users_with_tags()
-    count = len(relevant_users)
+    count = await count_relevant_users()
     await state.update_data(prev_relevant_count=count)
 
     keyboard = InlineKeyboardMarkup().add(
@@ -116,14 +70,9 @@ async def handle_admin(message: types.Message, state: FSMContext):
 
 # Callback-хэндлер для обновления
 async def refresh_relevant_users(call: CallbackQuery, state: FSMContext):
-    user_id = call.from_user.id
-    if not user_id in await get_admin_user_ids():
-        return await call.answer()
-
     data = await state.get_data()
     prev_count = data.get("prev_relevant_count", 0)
-    current_users = await get_relevant_users_with_tags()
-    current_count = len(current_users)
+    current_count = await count_relevant_users()
 
     if current_count != prev_count:
         await call.message.edit_text(
@@ -140,10 +89,6 @@ async def refresh_relevant_users(call: CallbackQuery, state: FSMContext):
 
 
 async def generate_link(message: types.Message):
-    user_id = message.from_user.id
-    if not user_id in await get_admin_user_ids():
-        return
-
     token = secrets.token_urlsafe(16)
 
     tokens_file = Path("tokens.json")
@@ -169,35 +114,31 @@ async def generate_link(message: types.Message):
     )
 
 
-async def _process_portfolio_with_ai(portfolio_text: str) -> tuple[list[str], bool]:
-    try:
-        with open("prompts.json", "r", encoding="utf-8") as f:
-            prompts = json.load(f)
-
-        known_tags = load_known_tags()
-        known_tags_str = ", ".join(known_tags)
-        prompt = f"{prompts['generate_tags']}Известные теги: {known_tags_str}\n\nВот портфолио:\n{portfolio_text}"
-
-        response_text = await generate_text(prompt)
-        parsed = json.loads(response_text)
-
-        tags = parsed.get("tags", [])
-        is_meaningful = parsed.get("mean", ["False"])[0] == "True"
-
-        return tags, is_meaningful
-
-    except Exception as e:
-        logger.error(f"JSON parsing error: {e}")
-        return [], False
-
 async def show_typing(chat_id):
     while True:
         await bot.send_chat_action(chat_id, "typing")
         await asyncio.sleep(3)
 
 
+TAGS_BATCH_SIZE = 20
+# Чаще Telegram начинает отвечать 429 на edit_text
+STATUS_UPDATE_SECONDS = 2.0
+
+
+async def flush_pending_tags(pending: dict[int, list[str]]):
+    """Записывает накопленные теги одной транзакцией и обновляет known_tags.json один раз."""
+    if not pending:
+        return
+    # Забираем пачку до await: параллельные задачи тем временем кладут теги уже в пустой pending
+    batch = dict(pending)
+    pending.clear()
+    await add_tags_many(batch)
+    update_known_tags([tag for tags in batch.values() for tag in tags])
+
+
 async def process_users_without_tags(message: types.Message):
     typing_task = asyncio.create_task(show_typing(message.chat.id))
+    pending = {}
 
     try:
         users = await get_relevant_users_without_tags()
@@ -208,57 +149,117 @@ async def process_users_without_tags(message: types.Message):
             return
 
         status_msg = await message.answer(f"🔧 Начинаю обработку {len(users)} пользователей...")
-
-        processed = 0
+        counts = {"processed": 0, "empty": 0, "failed": 0, "skipped": 0}
+        flush_lock = asyncio.Lock()
+        last_update = time.monotonic()
+
+        async def update_status(final: bool = False):
+            nonlocal last_update
+            if not final and time.monotonic() - last_update < STATUS_UPDATE_SECONDS:
+                return
+            last_update = time.monotonic()
+            done = sum(counts.values())
+            header = "🎉 Обработка завершена!" if final else f"🔄 Обработано {done}/{len(users)}"
+            text = (
+                f"{header}\n"
+                f"✅ С тегами: {counts['processed']}\n"
+                f"❌ Без полезной информации: {counts['empty']}\n"
+                f"⚠️ Ошибки модели: {counts['failed']}\n"
+                f"⏭ Без портфолио: {counts['skipped']}"
+            )
+            try:
+                await status_msg.edit_text(text)
+            except Exception as e:
+                logger.warning(f"Не удалось обновить статус: {e}")
+
+        async def process_batch(batch: dict[int, str]):
+            # Несколько портфолио на запрос; параллельность и частоту ограничивает роутер провайдеров
+            results, failed = await extract_tags_batch(batch)
+            for user_id, e in failed.items():
+                counts["failed"] += 1
+                logger.error(f"⚠️ Не удалось получить теги для {user_id}: {e}")
+
+            for user_id, (tags, is_meaningful) in results.items():
+                if not is_meaningful or not tags:
+                    counts["empty"] += 1
+                    logger.warning(f"❌ Портфолио {user_id} не содержит полезной информации")
+                    continue
+                pending[user_id] = tags
+                counts["processed"] += 1
+                logger.info(f"✅ Добавлены теги для {user_id}: {', '.join(tags)}")
+
+            if len(pending) >= TAGS_BATCH_SIZE:
+                async with flush_lock:
+                    await flush_pending_tags(pending)
+            await update_status()
+
+        portfolios = []
         for user in users:
-            user_id = user[1]
-            portfolio_text = user[3]
+            user_id, portfolio_text = user[1], user[3]
+            if portfolio_text:
+                portfolios.append((user_id, portfolio_text))
+            else:
+                counts["skipped"] += 1
 
-            if not portfolio_text:
-                await status_msg.edit_text(f"{status_msg.text}\n⏭ Пропускаю {user_id} - нет портфолио")
-                await asyncio.sleep(0.3)
-                continue
+        await asyncio.gather(*(
+            process_batch(dict(portfolios[start:start + PROMPT_BATCH_SIZE]))
+            for start in range(0, len(portfolios), PROMPT_BATCH_SIZE)
+        ))
 
-            await status_msg.edit_text(f"{status_msg.text}\n🔄 Обрабатываю пользователя {user_id}...")
-            tags, is_meaningful = await _process_portfolio_with_ai(portfolio_text)
-
-            if not is_meaningful or not tags:
-                await status_msg.edit_text(f"{status_msg.text}\n❌ Портфолио {user_id} не содержит полезной информации")
-                logger.warning(f"❌ Портфолио {user_id} не содержит полезной информации")
-                await asyncio.sleep(0.3)
-                continue
-
-            await add_tags(user_id, tags)
-            update_known_tags(tags)
-            await status_msg.edit_text(f"{status_msg.text}\n✅ Добавлены теги для {user_id}: {', '.join(tags)}")
-            logger.info(f"✅ Добавлены теги для {user_id}: {', '.join(tags)}")
-            processed += 1
-            await asyncio.sleep(1)
-
-        await status_msg.edit_text(f"🎉 Обработка завершена! Обработано: {processed}/{len(users)}")
-        logger.info("Генерация новых тегов завершена")
+        await flush_pending_tags(pending)
+        await update_status(final=True)
+        logger.info(f"Генерация новых тегов завершена: {counts}")
 
     except Exception as e:
         logger.error(f"⚠️ Ошибка: {str(e)}")
     finally:
         typing_task.cancel()
+        # Уже полученные от модели теги не теряем даже при ошибке посередине
+        await flush_pending_tags(pending)
+
+async def show_cache_stats(message: types.Message):
+    stats = get_user_cache_stats()
+    tag_stats = await get_tag_cache_stats()
+    await message.answer(
+        f"🗄 Кэш профилей: {stats['size']} записей\n"
+        f"• Попаданий: {stats['hits']}\n"
+        f"• Промахов: {stats['misses']}\n"
+        f"• Доля попаданий: {stats['hit_rate']:.0%}\n\n"
+        f"🏷 Кэш тегов: {tag_stats['size']} портфолио\n"
+        f"• Попаданий: {tag_stats['hits']} (за всё время: {tag_stats['total_hits']})\n"
+        f"• Промахов: {tag_stats['misses']}\n"
+        f"• Доля попаданий: {tag_stats['hit_rate']:.0%}"
+    )
+
+
+async def show_llm_stats(message: types.Message):
+    lines = ["🤖 Провайдеры LLM (по порядку):"]
+    for name, stats in get_router_stats().items():
+        latency = (
+            f"p50 {stats['p50']:.1f} s, p95 {stats['p95']:.1f} s"
+            if stats['p95'] is not None else "мало данных"
+        )
+        lines.append(f"• {name}: {stats['calls']} вызовов, ошибок {stats['error_rate']:.0%}, {latency}")
+    await message.answer("\n".join(lines))
 
-async def show_admin_commands(message: types.Message):
-    user_id = message.from_user.id
-    if not user_id in await get_admin_user_ids():
-        return
 
+async def show_admin_commands(message: types.Message):
     commands = [
         ("/get_users", "Показать количество актуальных участников"),
         ("/get_participant", "Сгенерировать ссылку для участия"),
         ("/admin_help", "Показать список команд для админов"),
         ("/get_admin_link", "Сгенерировать ссылку для назначения админа"),
         ("/generate_tags", "Сгенерировать теги для участников без тегов"),
-        ("/generate_teams", "Сгенерировать команды"),
+        ("/generate_teams", "Сгенерировать команды: [indexed|greedy|vectorized|sharded] [число прогонов] [секунд оптимизации]"),
+        ("/place_new", "Добавить новых участников в существующие команды"),
+        ("/rebalance_teams", "Выровнять размеры команд после выбывания участников"),
+        ("/what_if", "Сравнить конфигурации: /what_if 5,10,20 4,6 [режимы] [fresh]"),
         ("/clear_teams", "Удаление и очистка состава команд"),
         ("/activate_all", "Активирует всех пользователей (relevance = 1)"),
         ("/deactivate_all", "Деактивирует всех пользователей (relevance = 0)"),
-        ("/notify_empty_portfolio", "разослать сообщение о необходимости заполнить портфолио")
+        ("/notify_empty_portfolio", "разослать сообщение о необходимости заполнить портфолио"),
+        ("/cache_stats", "Статистика кэша профилей и тегов"),
+        ("/llm_stats", "Задержки и ошибки провайдеров LLM")
     ]
 
     response = "📝 <b>Доступные команды для админов:</b>\n\n"
@@ -268,12 +269,13 @@ async def show_admin_commands(message: types.Message):
 
 
 def register_handlers(dp: Dispatcher):
-    register_filters(dp)
     dp.register_message_handler(handle_admin, commands=["get_users"], state="*", is_admin=True)
     dp.register_message_handler(generate_link, commands=["get_participant"], is_admin=True)
     dp.register_message_handler(generate_admin_link, commands=["get_admin_link"], is_admin=True)
     dp.register_message_handler(show_admin_commands, commands=["admin_help"], is_admin=True)
     dp.register_message_handler(process_users_without_tags, commands=["generate_tags"], is_admin=True)
-    dp.register_callback_query_handler(refresh_relevant_users, text="refresh_relevant_users", state="*")
+    dp.register_callback_query_handler(refresh_relevant_users, text="refresh_relevant_users", state="*", is_admin=True)
     dp.register_message_handler(activate_all, commands=["activate_all"], is_admin=True)
     dp.register_message_handler(deactivate_all, commands=["deactivate_all"], is_admin=True)
+    dp.register_message_handler(show_cache_stats, commands=["cache_stats"], is_admin=True)
+    dp.register_message_handler(show_llm_stats, commands=["llm_stats"], is_admin=True)
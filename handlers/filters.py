@@ -0,0 +1,18 @@
+from aiogram import types, Dispatcher
+from aiogram.dispatcher.filters import BoundFilter
+from db.admin import is_admin
+
+
+class IsAdminFilter(BoundFilter):
+    key = 'is_admin'
+
+    def __init__(self, is_admin):
+        self.is_admin = is_admin
+
+    async def check(self, obj: types.Message | types.CallbackQuery):
+        # Множество админов держится в памяти db.admin, запроса к базе здесь нет
+        return await is_admin(obj.from_user.id) == self.is_admin
+
+
+def register_filters(dp: Dispatcher):
+    dp.filters_factory.bind(IsAdminFilter)
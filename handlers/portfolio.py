@@ -4,31 +4,15 @@ from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.types import ReplyKeyboardRemove
 from db.users import get_user, update_user_portfolio, get_user_portfolio, delete_user_portfolio, update_user_username
 from db.tags import add_tags
-from services.local_AI import generate_text
+from services.tagging import process_portfolio_with_ai, update_known_tags
 import asyncio
 from keyboards import reply_keyboard
 import json
-import os
 from app.loger_setup import get_logger
 
 
 logger = get_logger(__name__, level="INFO")
 
-def load_known_tags():
-    if not os.path.exists("known_tags.json"):
-        return []
-    with open("known_tags.json", "r", encoding="utf-8") as f:
-        return json.load(f)
-
-def save_known_tags(tags: list[str]):
-    with open("known_tags.json", "w", encoding="utf-8") as f:
-        json.dump(sorted(set(tags)), f, ensure_ascii=False, indent=2)
-
-def update_known_tags(new_tags: list[str]):
-    known = set(load_known_tags())
-    updated = known.union(new_tags)
-    save_known_tags(list(updated))
-
 def load_prompt(key: str, path="prompts.json") -> str:
     with open(path, "r", encoding="utf-8") as f:
         prompts = json.load(f)
@@ -140,7 +124,7 @@ async def process_portfolio_text(message: types.Message, state: FSMContext):
         is_meaningful = True
 
         if USE_AI:
-            tags, is_meaningful = await _process_portfolio_with_ai(portfolio_text)
+            tags, is_meaningful = await process_portfolio_with_ai(portfolio_text)
             if not is_meaningful or not tags:
                 await message.answer(
                     "❌ Ваш профиль не содержит достаточно сведений.\n"
@@ -187,27 +171,6 @@ async def process_portfolio_text(message: types.Message, state: FSMContext):
     finally:
         typing_task.cancel()
 
-async def _process_portfolio_with_ai(portfolio_text: str) -> tuple[list[str], bool]:
-    try:
-        with open("prompts.json", "r", encoding="utf-8") as f:
-            prompts = json.load(f)
-
-        known_tags = load_known_tags()
-        known_tags_str = ", ".join(known_tags)
-        prompt = f"{prompts['generate_tags']}Известные теги: {known_tags_str}\n\nВот портфолио:\n{portfolio_text}"
-
-        response_text = await generate_text(prompt)
-        parsed = json.loads(response_text)
-
-        tags = parsed.get("tags", [])
-        is_meaningful = parsed.get("mean", ["False"])[0] == "True"
-
-        return tags, is_meaningful
-
-    except Exception as e:
-        logger.error(f"JSON parsing error: {e}")
-        return [], False
-
 async def confirm_tags_save(message: types.Message, state: FSMContext):
     if message.text == "✅ Да, сохранить":
         async with state.proxy() as data:
@@ -335,8 +298,8 @@ async def choose_edit_handler(message: types.Message, state: FSMContext):
 
 async def show_portfolio(message: types.Message):
     user_id = message.from_user.id
-    portfolio = await get_user_portfolio(user_id)
     user = await get_user(user_id)  # Получаем объект пользователя
+    portfolio = user.portfolio if user else None
 
     # Получаем username через атрибут, а не через .get()
     username = getattr(user, "username", "Не указано ФИО") if user else "Не указано ФИО"
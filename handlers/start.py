@@ -1,5 +1,5 @@
 from aiogram import types
-from db.users import add_user, get_user_portfolio, get_user, set_relevance_true_by_user_id
+from db.users import add_user, get_user, set_relevance_true_by_user_id
 from db.admin import add_admin
 from db.models import User
 from keyboards import reply_keyboard
@@ -29,12 +29,12 @@ async def start_handler(message: types.Message):
     args = message.get_args()
 
 
-    if not await get_user(user_id):
-        user = User(user_id=user_id, username=username, portfolio="", team_id=None)
-        await add_user(user)
-
-    portfolio = await get_user_portfolio(user_id)
     user = await get_user(user_id)
+    if not user:
+        await add_user(User(user_id=user_id, username=username, portfolio="", team_id=None))
+        user = await get_user(user_id)
+
+    portfolio = user.portfolio if user else None
 
     if not args:
         if not portfolio or portfolio.strip() == "":
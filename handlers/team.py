@@ -1,30 +1,44 @@
 from aiogram import types
-from aiogram.dispatcher.filters import BoundFilter
 from aiogram import Dispatcher
-from db.teams import TeamDistributor
-from db.admin import get_admin_user_ids
+from db.teams import run_distribution, run_clear_teams, run_late_joiners, run_rebalance, run_what_if
+from services.team_logic import PLANNERS, format_sweep_table, parse_sweep_grid
+from db.db import connection
+from db.users import user_cache
 from app.config import bot
-import aiosqlite
 import asyncio
+import time
+from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from app.loger_setup import get_logger
 
 
 logger = get_logger(__name__, level="INFO")
 
+TEAM_COLOR_LIMITS = {
+    "Розовые": 1,
+    "Жёлтые": 0,
+    "Зелёные": 0,
+    "Белые": 0,
+}
+MAX_TEAM_SIZE = 2
+PROGRESS_INTERVAL = 2.0
+# Локальный поиск после планировщика включается третьим аргументом /generate_teams, секунд
+OPTIMIZE_SECONDS = 0.0
+MAX_OPTIMIZE_SECONDS = 60.0
+# Верхняя граница прогонов с разным порядком участников (каждый — отдельный процесс из пула)
+MAX_RESTARTS = 64
 
-class IsAdminFilter(BoundFilter):
-    key = 'is_admin'
+# Распределение — синхронный sqlite3 и чистый Python; держим его вне event loop,
+# чтобы бот продолжал отвечать остальным пользователям
+distribution_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="distribution")
+distribution_lock = asyncio.Lock()
 
-    def __init__(self, is_admin):
-        self.is_admin = is_admin
 
-    async def check(self, message: types.Message):
-        admin_ids = await get_admin_user_ids()
-        return message.from_user.id in admin_ids
-
-
-def register_filters(dp: Dispatcher):
-    dp.filters_factory.bind(IsAdminFilter)
+def log_progress_error(future):
+    # MessageNotModified, 429 и т.п. при правке прогресса не критичны, но и терять их молча не стоит
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning(f"Не удалось обновить прогресс: {future.exception()!r}")
 
 
 # noinspection PyBroadException
@@ -40,127 +54,269 @@ async def get_user_display_info(user_id: int) -> str:
 
 
 async def generate_teams(message: types.Message):
-    if message.from_user.id not in await get_admin_user_ids():
+    # /generate_teams [indexed|greedy|vectorized|sharded] [прогонов] [секунд оптимизации];
+    # по умолчанию — indexed, один прогон, без локального поиска
+    args = message.get_args().split()
+    mode = args[0] if args else "indexed"
+    if mode not in PLANNERS:
+        await message.answer(f"❌ Неизвестный режим: {mode}. Доступны: {', '.join(PLANNERS)}")
+        return
+    if len(args) > 1 and not (args[1].isdigit() and 1 <= int(args[1]) <= MAX_RESTARTS):
+        await message.answer(f"❌ Число прогонов должно быть от 1 до {MAX_RESTARTS}")
         return
+    restarts = int(args[1]) if len(args) > 1 else 1
+    optimize_seconds = OPTIMIZE_SECONDS
+    if len(args) > 2:
+        try:
+            optimize_seconds = float(args[2])
+        except ValueError:
+            optimize_seconds = -1.0
+        if not 0 <= optimize_seconds <= MAX_OPTIMIZE_SECONDS:
+            await message.answer(f"❌ Время оптимизации должно быть от 0 до {MAX_OPTIMIZE_SECONDS:g} секунд")
+            return
 
-    try:
-        with TeamDistributor() as distributor:
-            distributor.setup_colors({
-                "Розовые": 1,
-                "Жёлтые": 0,
-                "Зелёные": 0,
-                "Белые": 0,
-            })
-            distributor.distribute_users(max_team_size=2)
-
-        await send_team_notifications()
-        await message.answer("✅ Команды успешно сформированы и уведомления разосланы!")
-    except Exception as e:
-        await message.answer(f"❌ Ошибка: {str(e)}")
+    if distribution_lock.locked():
+        await message.answer("⏳ Распределение уже выполняется, дождитесь завершения.")
+        return
 
+    async with distribution_lock:
+        loop = asyncio.get_running_loop()
+        status_msg = await message.answer("⏳ Распределяю участников по командам...")
+        last_report = 0.0
+        progress_edits = []
+
+        def report_progress(done: int, total: int):
+            # Вызывается из рабочего потока: правим сообщение через event loop и не чаще раза в пару секунд
+            nonlocal last_report
+            now = time.monotonic()
+            if now - last_report < PROGRESS_INTERVAL and done < total:
+                return
+            last_report = now
+            future = asyncio.run_coroutine_threadsafe(
+                status_msg.edit_text(f"⏳ Распределено {done}/{total} участников..."), loop
+            )
+            future.add_done_callback(log_progress_error)
+            progress_edits.append(future)
+
+        try:
+            result = await loop.run_in_executor(
+                distribution_executor,
+                partial(run_distribution, TEAM_COLOR_LIMITS, MAX_TEAM_SIZE, report_progress, mode,
+                        optimize_seconds, restarts)
+            )
+            # team_id менялся в обход db.users — кэш профилей больше не актуален
+            user_cache.clear()
+            # Последняя правка прогресса не должна прийти в Telegram позже итоговой и затереть её
+            if progress_edits:
+                await asyncio.wait([asyncio.wrap_future(future) for future in progress_edits])
+
+            summary = f"✅ Распределено участников: {result.assigned}."
+            if result.search:
+                summary += f" Конфликтов тегов: {result.search.conflicts_before} → {result.search.conflicts_after}."
+            await status_msg.edit_text(f"{summary} Рассылаю уведомления...")
+            await send_team_notifications()
+            await message.answer("✅ Команды успешно сформированы и уведомления разосланы!")
+        except Exception as e:
+            logger.error(f"Ошибка распределения: {e}")
+            await message.answer(f"❌ Ошибка: {str(e)}")
+
+
+async def send_team_notifications(joined: Optional[Dict[int, List[int]]] = None):
+    """Рассылает состав команд. joined ({team_id: [user_id]}) — только эти команды, с пометкой новичков."""
+    team_filter, params = "", ()
+    if joined is not None:
+        if not joined:
+            return
+        team_filter = f"AND t.id IN ({', '.join('?' * len(joined))})"
+        params = tuple(joined)
 
-async def send_team_notifications():
-    async with aiosqlite.connect("main.db") as conn:
-        conn.row_factory = aiosqlite.Row
-        cursor = await conn.execute("""
+    async with connection() as conn:
+        cursor = await conn.execute(f"""
             SELECT t.id, t.colors, GROUP_CONCAT(u.user_id) as user_ids
             FROM teams t
             JOIN users u ON t.id = u.team_id
-            WHERE u.relevance = 1
+            WHERE u.relevance = 1 {team_filter}
             GROUP BY t.id
-        """)
+        """, params)
 
         teams = await cursor.fetchall()
-        tasks = []
 
-        for team in teams:
-            user_ids = team["user_ids"].split(",") if team["user_ids"] else []
+    tasks = []
 
-            members_info = await asyncio.gather(
-                *[get_user_display_info(int(user_id)) for user_id in user_ids],
-                return_exceptions=True
-            )
+    for team in teams:
+        user_ids = team["user_ids"].split(",") if team["user_ids"] else []
 
-            members_list = "\n".join(
-                f"- {info}" if not isinstance(info, Exception)
-                else f"- ID{user_id}"
-                for user_id, info in zip(user_ids, members_info)
-            )
+        members_info = await asyncio.gather(
+            *[get_user_display_info(int(user_id)) for user_id in user_ids],
+            return_exceptions=True
+        )
 
-            message_text = (
-                f"🎉 Ваша команда сформирована!\n\n"
-                f"🔹 Номер: {team['id']}\n"
-                f"🎨 Цвет: {team['colors']}\n\n"
-                f"👥 Состав:\n{members_list}"
-            )
+        # При досадке новичков помечаем, остальным участникам команды это подсказка, кто пришёл
+        newcomers = {str(user_id) for user_id in joined[team["id"]]} if joined is not None else set()
+        members_list = "\n".join(
+            (f"- {info}" if not isinstance(info, Exception) else f"- ID{user_id}")
+            + (" 🆕" if user_id in newcomers else "")
+            for user_id, info in zip(user_ids, members_info)
+        )
+        header = "🎉 Ваша команда сформирована!" if joined is None else "👋 В вашей команде пополнение!"
 
-            tasks.extend(
-                bot.send_message(
-                    chat_id=int(user_id),
-                    text=message_text,
-                    parse_mode="HTML"
-                ) for user_id in user_ids
-            )
+        message_text = (
+            f"{header}\n\n"
+            f"🔹 Номер: {team['id']}\n"
+            f"🎨 Цвет: {team['colors']}\n\n"
+            f"👥 Состав:\n{members_list}"
+        )
+
+        tasks.extend(
+            bot.send_message(
+                chat_id=int(user_id),
+                text=message_text,
+                parse_mode="HTML"
+            ) for user_id in user_ids
+        )
 
-        await asyncio.gather(*tasks, return_exceptions=True)
+    await asyncio.gather(*tasks, return_exceptions=True)
 
 
 async def team_info(message: types.Message):
     user_id = message.from_user.id
 
-    async with aiosqlite.connect("main.db") as conn:
-        conn.row_factory = aiosqlite.Row
-
+    # Соединение из пула держим только на время запросов, не на время обращений к Telegram
+    async with connection() as conn:
         cursor = await conn.execute("SELECT team_id FROM users WHERE user_id = ?", (user_id,))
         user_team = await cursor.fetchone()
 
         if not user_team or not user_team["team_id"]:
-            await message.answer("Вы пока не в команде.")
+            team_id = None
+        else:
+            team_id = user_team["team_id"]
+
+            cursor = await conn.execute("SELECT user_id FROM users WHERE team_id = ?", (team_id,))
+            member_ids = [row["user_id"] for row in await cursor.fetchall()]
+
+            cursor = await conn.execute("SELECT colors FROM teams WHERE id = ?", (team_id,))
+            team_info_ = await cursor.fetchone()
+            color = team_info_["colors"] if team_info_ else "Не указан"
+
+    if team_id is None:
+        await message.answer("Вы пока не в команде.")
+        return
+
+    members_info = await asyncio.gather(
+        *[get_user_display_info(member_id) for member_id in member_ids],
+        return_exceptions=True
+    )
+
+    members_list = "\n".join(
+        f"- {info}" if not isinstance(info, Exception)
+        else f"- [Пользователь {member_id}]"
+        for member_id, info in zip(member_ids, members_info)
+    )
+
+    await message.answer(
+        f"🔹 Команда №{team_id}\n"
+        f"🎨 Цвет: {color}\n\n"
+        f"👥 Участники:\n{members_list}",
+        parse_mode="HTML"
+    )
+
+
+async def place_late_joiners(message: types.Message):
+    # Досадка опоздавших в уже сформированные команды: состав остальных не меняется
+    if distribution_lock.locked():
+        await message.answer("⏳ Распределение уже выполняется, дождитесь завершения.")
+        return
+
+    async with distribution_lock:
+        try:
+            joined = await asyncio.get_running_loop().run_in_executor(
+                distribution_executor, partial(run_late_joiners, TEAM_COLOR_LIMITS, MAX_TEAM_SIZE)
+            )
+        except Exception as e:
+            logger.error(f"Ошибка досадки участников: {e}")
+            await message.answer(f"❌ Ошибка: {str(e)}")
             return
 
-        team_id = user_team["team_id"]
+    if not joined:
+        await message.answer("✅ Новых участников без команды нет.")
+        return
 
-        cursor = await conn.execute("SELECT user_id FROM users WHERE team_id = ?", (team_id,))
-        member_ids = [row["user_id"] for row in await cursor.fetchall()]
+    for user_ids in joined.values():
+        for user_id in user_ids:
+            user_cache.invalidate(user_id)
+    await send_team_notifications(joined)
+    await message.answer(
+        f"✅ Добавлено участников: {sum(map(len, joined.values()))}, затронуто команд: {len(joined)}. "
+        f"Уведомления разосланы."
+    )
 
-        members_info = await asyncio.gather(
-            *[get_user_display_info(member_id) for member_id in member_ids],
-            return_exceptions=True
-        )
 
-        cursor = await conn.execute("SELECT colors FROM teams WHERE id = ?", (team_id,))
-        team_info_ = await cursor.fetchone()
-        color = team_info_["colors"] if team_info_ else "Не указан"
+async def rebalance_teams(message: types.Message):
+    # Выравнивание размеров после выбывания участников: переносится минимум людей, остальные остаются
+    if distribution_lock.locked():
+        await message.answer("⏳ Распределение уже выполняется, дождитесь завершения.")
+        return
 
-        members_list = "\n".join(
-            f"- {info}" if not isinstance(info, Exception)
-            else f"- [Пользователь {member_id}]"
-            for member_id, info in zip(member_ids, members_info)
-        )
+    async with distribution_lock:
+        try:
+            moves = await asyncio.get_running_loop().run_in_executor(
+                distribution_executor, partial(run_rebalance, MAX_TEAM_SIZE)
+            )
+        except Exception as e:
+            logger.error(f"Ошибка перебалансировки команд: {e}")
+            await message.answer(f"❌ Ошибка: {str(e)}")
+            return
 
-        await message.answer(
-            f"🔹 Команда №{team_id}\n"
-            f"🎨 Цвет: {color}\n\n"
-            f"👥 Участники:\n{members_list}",
-            parse_mode="HTML"
-        )
+    if not moves:
+        await message.answer("✅ Размеры команд уже в допустимых границах.")
+        return
+
+    joined: Dict[int, List[int]] = {}
+    for move in moves:
+        user_cache.invalidate(move.user_id)
+        joined.setdefault(move.target, []).append(move.user_id)
+    await send_team_notifications(joined)
+    await message.answer(f"✅ Перенесено участников: {len(moves)}, затронуто команд: {len(joined)}.")
+
+
+async def what_if(message: types.Message):
+    # /what_if <команд через запятую> <размеры через запятую> [режимы] [fresh]; main.db только читается.
+    # fresh — перечитать участников из базы, не дожидаясь истечения WHAT_IF_SNAPSHOT_TTL
+    args = message.get_args().split()
+    fresh = "fresh" in args[2:]
+    args = [arg for arg in args if arg != "fresh"]
+    if len(args) < 2:
+        await message.answer("Использование: /what_if 5,10,20 4,6 [indexed,greedy] [fresh]")
+        return
+    try:
+        grid = parse_sweep_grid(args[0], args[1], list(TEAM_COLOR_LIMITS), args[2] if len(args) > 2 else "indexed")
+    except ValueError as e:
+        await message.answer(f"❌ {e}")
+        return
+
+    status_msg = await message.answer(f"⏳ Считаю {len(grid)} конфигураций...")
+    try:
+        rows = await asyncio.get_running_loop().run_in_executor(None, partial(run_what_if, grid, refresh=fresh))
+    except Exception as e:
+        logger.error(f"Ошибка what-if: {e}")
+        await status_msg.edit_text(f"❌ Ошибка: {str(e)}")
+        return
+    await status_msg.edit_text(f"<pre>{format_sweep_table(rows)}</pre>", parse_mode="HTML")
 
 
 async def clear_teams(message: types.Message):
-    if message.from_user.id not in await get_admin_user_ids():
+    if distribution_lock.locked():
+        await message.answer("⏳ Идёт распределение, очистка недоступна.")
         return
 
-    with TeamDistributor() as distributor:
-        distributor.clear_all_teams()
+    async with distribution_lock:
+        await asyncio.get_running_loop().run_in_executor(distribution_executor, run_clear_teams)
+    user_cache.clear()
     await message.answer("✅ Команды очищены!")
 
 
 async def notify_empty_portfolio(message: types.Message):
-    if message.from_user.id not in await get_admin_user_ids():
-        return
-
-    async with aiosqlite.connect("main.db") as conn:
-        conn.row_factory = aiosqlite.Row
+    async with connection() as conn:
         cursor = await conn.execute("""
             SELECT user_id FROM users 
             WHERE portfolio IS NULL OR portfolio = ''
@@ -168,76 +324,90 @@ async def notify_empty_portfolio(message: types.Message):
 
         users_with_empty_portfolio = await cursor.fetchall()
 
-        if not users_with_empty_portfolio:
-            await message.answer("✅ У всех активных пользователей заполнено портфолио!")
-            return
+    if not users_with_empty_portfolio:
+        await message.answer("✅ У всех активных пользователей заполнено портфолио!")
+        return
 
-        total_count = len(users_with_empty_portfolio)
-        progress_message = await message.answer(
-            f"🔔 Найдено {total_count} пользователей с пустым портфолио\n\n"
-            f"🔄 Начинаю рассылку...\n"
-            f"0/{total_count} (0%)"
-        )
+    total_count = len(users_with_empty_portfolio)
+    progress_message = await message.answer(
+        f"🔔 Найдено {total_count} пользователей с пустым портфолио\n\n"
+        f"🔄 Начинаю рассылку...\n"
+        f"0/{total_count} (0%)"
+    )
 
-        success = 0
-        failed = 0
-        text = (
-            "🔔 Уведомление от системы нетворкинга\n\n"
-            "Ваше портфолио не заполнено. Это ограничивает ваши возможности участия:\n\n"
-            "• Вы не сможете быть распределены в команду\n"
-            "• Другие участники не увидят ваш профиль\n"
-            "• Доступ к нетворкинг-сессиям будет ограничен\n\n"
-            "📌 <b>Пожалуйста, заполните портфолио:</b>\n"
-            "1) Нажмите кнопку «Создать портфолио»\n"
-            "2) Укажите профессиональный опыт\n"
-            "3) Добавьте ключевые компетенции\n"
-            "4) Опишите цели для нетворкинга\n\n"
-            "Это займёт 2 минуты, но откроет доступ ко всем возможностям системы. "
-            "Наша платформа создана для осмысленных профессиональных связей - "
-            "дайте другим участникам возможность узнать о вас.\n\n"
-            "Спасибо за понимание!"
-        )
+    success = 0
+    failed = 0
+    text = (
+        "🔔 Уведомление от системы нетворкинга\n\n"
+        "Ваше портфолио не заполнено. Это ограничивает ваши возможности участия:\n\n"
+        "• Вы не сможете быть распределены в команду\n"
+        "• Другие участники не увидят ваш профиль\n"
+        "• Доступ к нетворкинг-сессиям будет ограничен\n\n"
+        "📌 <b>Пожалуйста, заполните портфолио:</b>\n"
+        "1) Нажмите кнопку «Создать портфолио»\n"
+        "2) Укажите профессиональный опыт\n"
+        "3) Добавьте ключевые компетенции\n"
+        "4) Опишите цели для нетворкинга\n\n"
+        "Это займёт 2 минуты, но откроет доступ ко всем возможностям системы. "
+        "Наша платформа создана для осмысленных профессиональных связей - "
+        "дайте другим участникам возможность узнать о вас.\n\n"
+        "Спасибо за понимание!"
+    )
 
-        for index, user in enumerate(users_with_empty_portfolio, 1):
-            try:
-                await bot.send_message(
-                    chat_id=user["user_id"],
-                    text=text,
-                    parse_mode="HTML"
-                )
-                success += 1
-            except Exception as e:
-                logger.warning(f"Ошибка отправки пользователю {user['user_id']}: {str(e)}")
-                failed += 1
-
-            # Обновляем прогресс после каждого пользователя
-            progress = int((index / total_count) * 100)
-            await progress_message.edit_text(
-                f"🔔 Найдено {total_count} пользователей\n\n"
-                f"🔄 Рассылка...\n"
-                f"{index}/{total_count} ({progress}%)\n\n"
-                f"✓ Успешно: {success}\n"
-                f"✕ Ошибки: {failed}"
+    for index, user in enumerate(users_with_empty_portfolio, 1):
+        try:
+            await bot.send_message(
+                chat_id=user["user_id"],
+                text=text,
+                parse_mode="HTML"
             )
+            success += 1
+        except Exception as e:
+            logger.warning(f"Ошибка отправки пользователю {user['user_id']}: {str(e)}")
+            failed += 1
 
-            await asyncio.sleep(0.3)  # Оптимальная задержка
-
+        # Обновляем прогресс после каждого пользователя
+        progress = int((index / total_count) * 100)
         await progress_message.edit_text(
-            f"✅ Рассылка завершена!\n\n"
-            f"• Всего пользователей: {total_count}\n"
-            f"• Успешно отправлено: {success}\n"
-            f"• Не удалось отправить: {failed}\n\n"
+            f"🔔 Найдено {total_count} пользователей\n\n"
+            f"🔄 Рассылка...\n"
+            f"{index}/{total_count} ({progress}%)\n\n"
+            f"✓ Успешно: {success}\n"
+            f"✕ Ошибки: {failed}"
         )
 
+        await asyncio.sleep(0.3)  # Оптимальная задержка
+
+    await progress_message.edit_text(
+        f"✅ Рассылка завершена!\n\n"
+        f"• Всего пользователей: {total_count}\n"
+        f"• Успешно отправлено: {success}\n"
+        f"• Не удалось отправить: {failed}\n\n"
+    )
+
 
 def register_handlers(dp: Dispatcher):
-    register_filters(dp)
 
     dp.register_message_handler(
         generate_teams,
         commands=["generate_teams"],
         is_admin=True
     )
+    dp.register_message_handler(
+        place_late_joiners,
+        commands=["place_new"],
+        is_admin=True
+    )
+    dp.register_message_handler(
+        rebalance_teams,
+        commands=["rebalance_teams"],
+        is_admin=True
+    )
+    dp.register_message_handler(
+        what_if,
+        commands=["what_if"],
+        is_admin=True
+    )
     dp.register_message_handler(
         clear_teams,
         commands=["clear_teams"],
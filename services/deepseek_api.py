@@ -5,6 +5,7 @@ from dotenv import load_dotenv
 import os
 import sys
 from app.loger_setup import get_logger
+from services.http_client import get_session, close_http_clients
 
 
 logger = get_logger(__name__, level="ERROR")
@@ -16,6 +17,7 @@ load_dotenv()
 
 API_KEY = os.getenv('TOKEN_DEEPSEEK')
 API_URL = 'https://openrouter.ai/api/v1/chat/completions'
+MODEL = "deepseek/deepseek-r1:free"  # Убедись, что модель актуальна
 
 
 async def generate_text(text: str) -> str:
@@ -25,11 +27,12 @@ async def generate_text(text: str) -> str:
     }
 
     data = {
-        "model": "deepseek/deepseek-r1:free",  # Убедись, что модель актуальна
+        "model": MODEL,
         "messages": [{"role": "user", "content": text}]
     }
 
-    async with aiohttp.ClientSession() as session:
+    session = get_session("deepseek")
+    try:
         async with session.post(API_URL, json=data, headers=headers) as response:
             logger.debug(f"Status: {response.status}")
             logger.debug(f"Response Text: {await response.text()}")
@@ -44,11 +47,14 @@ async def generate_text(text: str) -> str:
                 return ai_text
             else:
                 logger.error(f"Failed to fetch data from API. Status Code: {response.status}")
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error(f"Network error: {e!r}")
 
 
 async def main():
     result = await generate_text("Расскажи анекдот")
     print(result)
+    await close_http_clients()
 
 
 if __name__ == '__main__':
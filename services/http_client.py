@@ -0,0 +1,49 @@
+import aiohttp
+from typing import Dict
+from app.loger_setup import get_logger
+
+logger = get_logger(__name__, level="INFO")
+
+# Одновременных соединений на провайдера: локальная модель не тянет много параллельных запросов
+PROVIDER_CONNECTION_LIMITS = {
+    "local": 4,
+    "gemini": 16,
+    "deepseek": 8,
+}
+DEFAULT_CONNECTION_LIMIT = 8
+KEEPALIVE_SECONDS = 60
+CONNECT_TIMEOUT = 10
+# Генерация тегов по длинному портфолио может идти десятки секунд
+READ_TIMEOUT = 120
+
+_sessions: Dict[str, aiohttp.ClientSession] = {}
+
+
+def _create_session(provider: str) -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=PROVIDER_CONNECTION_LIMITS.get(provider, DEFAULT_CONNECTION_LIMIT),
+        keepalive_timeout=KEEPALIVE_SECONDS,
+        ttl_dns_cache=300,
+    )
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+def get_session(provider: str) -> aiohttp.ClientSession:
+    """Общая сессия провайдера с пулом keep-alive соединений; создаётся при первом обращении."""
+    session = _sessions.get(provider)
+    if session is None or session.closed:
+        session = _sessions[provider] = _create_session(provider)
+    return session
+
+
+async def open_http_clients():
+    for provider in PROVIDER_CONNECTION_LIMITS:
+        get_session(provider)
+    logger.info("HTTP-клиенты LLM открыты")
+
+
+async def close_http_clients():
+    while _sessions:
+        _, session = _sessions.popitem()
+        await session.close()
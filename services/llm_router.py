@@ -0,0 +1,171 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from app.loger_setup import get_logger
+from services import deepseek_api, gemini_api, local_AI
+from services.rate_limit import get_limiter
+
+logger = get_logger(__name__, level="INFO")
+
+load_dotenv()
+
+# Порядок по умолчанию; провайдеры без ключа/адреса в .env пропускаются
+PROVIDER_ORDER = [name.strip() for name in os.getenv("LLM_PROVIDERS", "local,gemini,deepseek").split(",") if name.strip()]
+
+STATS_WINDOW = 100          # последних вызовов на провайдера
+STATS_MAX_AGE = 300.0       # секунд: старые ошибки не должны навсегда хоронить провайдера
+MIN_SAMPLES = 5             # до этого p95 не считаем и не хеджируем
+MAX_ERROR_RATE = 0.5        # выше — провайдер уходит в конец очереди
+FAILED_RESPONSE = "⚠️ Все модели недоступны. Попробуйте позже."
+
+
+class Provider:
+    """Бэкенд generate_text со скользящей статистикой задержек и ошибок."""
+
+    def __init__(self, name: str, model: str, generate: Callable[[str], Awaitable[Optional[str]]]):
+        self.name = name
+        self.model = model
+        self.generate = generate
+        # (время завершения, задержка, успех)
+        self._samples: deque = deque(maxlen=STATS_WINDOW)
+
+    def record(self, latency: float, ok: bool):
+        self._samples.append((time.monotonic(), latency, ok))
+
+    def _recent(self):
+        horizon = time.monotonic() - STATS_MAX_AGE
+        while self._samples and self._samples[0][0] < horizon:
+            self._samples.popleft()
+        return self._samples
+
+    @property
+    def error_rate(self) -> float:
+        samples = self._recent()
+        return sum(not ok for _, _, ok in samples) / len(samples) if samples else 0.0
+
+    def latency_quantile(self, q: float) -> Optional[float]:
+        latencies = sorted(latency for _, latency, ok in self._recent() if ok)
+        if len(latencies) < MIN_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * q))]
+
+    @property
+    def healthy(self) -> bool:
+        return self.error_rate <= MAX_ERROR_RATE
+
+    def stats(self) -> Dict:
+        p50, p95 = self.latency_quantile(0.5), self.latency_quantile(0.95)
+        return {"calls": len(self._recent()), "error_rate": self.error_rate, "p50": p50, "p95": p95}
+
+
+def _configured_providers() -> List[Provider]:
+    available = {
+        "local": (local_AI.API_URL, Provider("local", local_AI.MODEL, local_AI.generate_text)),
+        "gemini": (gemini_api.API_KEY, Provider("gemini", gemini_api.MODEL, gemini_api.generate_text)),
+        "deepseek": (deepseek_api.API_KEY, Provider("deepseek", deepseek_api.MODEL, deepseek_api.generate_text)),
+    }
+    providers = [available[name][1] for name in PROVIDER_ORDER if name in available and available[name][0]]
+    if not providers:
+        # Без настроек оставляем прежнее поведение — локальная модель
+        providers = [available["local"][1]]
+    return providers
+
+
+providers: List[Provider] = _configured_providers()
+
+
+def primary_model() -> str:
+    return providers[0].model
+
+
+def is_failure(text: Optional[str]) -> bool:
+    # Провайдеры сообщают об ошибке строкой "⚠️ ..." (deepseek — None), а не исключением
+    return not text or text.startswith("⚠️")
+
+
+def ordered_providers() -> List[Provider]:
+    """Здоровые в порядке PROVIDER_ORDER, затем остальные — как последний шанс."""
+    return sorted(providers, key=lambda provider: not provider.healthy)
+
+
+async def _call(provider: Provider, text: str, acquired: asyncio.Event, interactive: bool) -> Optional[str]:
+    async with get_limiter(provider.name).slot(interactive):
+        acquired.set()
+        started = time.monotonic()
+        try:
+            result = await provider.generate(text)
+        except asyncio.CancelledError:
+            # Проигравший хедж-запрос: не считаем ни успехом, ни ошибкой
+            raise
+        except Exception as e:
+            logger.error(f"{provider.name}: {e!r}")
+            result = None
+        provider.record(time.monotonic() - started, not is_failure(result))
+    if is_failure(result):
+        logger.warning(f"{provider.name} не ответил: {result!r}")
+    return result
+
+
+async def generate_text_with_provider(text: str, hedge: bool = False) -> Tuple[str, Optional[Provider]]:
+    """generate_text с переключением на следующий провайдер при ошибке; вернёт (ответ, ответивший провайдер).
+
+    hedge=True: если основной запрос дольше p95 провайдера, параллельно отправляется второй
+    к следующему провайдеру, берётся первый успешный ответ. Задержка интерактивных запросов
+    тогда ограничена примерно p95, но нагрузка на модели растёт на несколько процентов.
+    Ожидание в лимитере своего провайдера в этот таймер не входит — как и в записанный p95,
+    поэтому хеджируемый запрос считается интерактивным и в лимитере обходит очередь массовых.
+    Если не ответил никто — (FAILED_RESPONSE, None).
+    """
+    queue = ordered_providers()
+    running: Dict[asyncio.Task, Provider] = {}
+    acquired: Dict[asyncio.Task, asyncio.Event] = {}
+
+    def launch():
+        provider = queue.pop(0)
+        event = asyncio.Event()
+        task = asyncio.create_task(_call(provider, text, event, interactive=hedge))
+        running[task] = provider
+        acquired[task] = event
+
+    try:
+        launch()
+        while running:
+            timeout = None
+            if hedge and queue and len(running) == 1:
+                task, provider = next(iter(running.items()))
+                timeout = provider.latency_quantile(0.95)
+                if timeout is not None and not acquired[task].is_set():
+                    # Очередь к своему провайдеру — не повод тратить квоту резервного
+                    waiter = asyncio.create_task(acquired[task].wait())
+                    try:
+                        await asyncio.wait({task, waiter}, return_when=asyncio.FIRST_COMPLETED)
+                    finally:
+                        waiter.cancel()
+            done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                logger.info(f"{next(iter(running.values())).name} дольше p95, хеджирую через {queue[0].name}")
+                launch()
+                continue
+            for task in done:
+                provider = running.pop(task)
+                result = task.result()
+                if not is_failure(result):
+                    return result, provider
+            if not running and queue:
+                launch()
+        return FAILED_RESPONSE, None
+    finally:
+        for task in running:
+            task.cancel()
+
+
+async def generate_text(text: str, hedge: bool = False) -> str:
+    result, _ = await generate_text_with_provider(text, hedge)
+    return result
+
+
+def get_router_stats() -> Dict[str, Dict]:
+    return {provider.name: provider.stats() for provider in providers}
@@ -0,0 +1,106 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+
+# concurrency — одновременных запросов, rate — запросов в секунду в среднем, burst — сколько можно сразу.
+# Лимиты бесплатных тарифов: Gemini ~15 запросов в минуту, OpenRouter free ~20 в минуту
+PROVIDER_RATE_LIMITS = {
+    "local": {"concurrency": 4, "rate": 8.0, "burst": 4},
+    "gemini": {"concurrency": 4, "rate": 0.25, "burst": 5},
+    "deepseek": {"concurrency": 2, "rate": 0.3, "burst": 3},
+}
+DEFAULT_RATE_LIMIT = {"concurrency": 2, "rate": 1.0, "burst": 2}
+
+
+class TokenBucket:
+    """Ведро токенов: в среднем rate запросов в секунду, не больше capacity подряд."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+
+    def try_acquire(self) -> float:
+        """Берёт токен и возвращает 0 или, если токенов нет, через сколько секунд появится следующий."""
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+
+class ProviderLimiter:
+    """Ограничение параллельных запросов и их частоты с двумя очередями ожидания.
+
+    async with limiter: — массовый запрос; async with limiter.slot(interactive=True): — запрос,
+    которого ждёт пользователь: он проходит раньше всех массовых, ожидающих слот или токен.
+    Иначе пачка тегирования на сотни портфолио держала бы интерактивный запрос минутами.
+    """
+
+    def __init__(self, concurrency: int, rate: float, burst: int):
+        self._free = concurrency
+        self._bucket = TokenBucket(rate, burst)
+        self._interactive: Deque[object] = deque()
+        self._bulk: Deque[object] = deque()
+        self._changed = asyncio.Condition()
+
+    def _next(self) -> Optional[object]:
+        queue = self._interactive or self._bulk
+        return queue[0] if queue else None
+
+    async def acquire(self, interactive: bool = False):
+        queue = self._interactive if interactive else self._bulk
+        ticket = object()
+        async with self._changed:
+            queue.append(ticket)
+            try:
+                while True:
+                    delay = None
+                    if self._next() is ticket and self._free > 0:
+                        delay = self._bucket.try_acquire()
+                        if not delay:
+                            self._free -= 1
+                            return
+                    # Пока первый в очереди ждёт токен, может прийти интерактивный — будим по таймеру и по событию
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                queue.remove(ticket)
+                self._changed.notify_all()
+
+    async def release(self):
+        async with self._changed:
+            self._free += 1
+            self._changed.notify_all()
+
+    @asynccontextmanager
+    async def slot(self, interactive: bool = False):
+        await self.acquire(interactive)
+        try:
+            yield self
+        finally:
+            await self.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.release()
+
+
+_limiters: Dict[str, ProviderLimiter] = {}
+
+
+def get_limiter(provider: str) -> ProviderLimiter:
+    limiter = _limiters.get(provider)
+    if limiter is None:
+        limiter = _limiters[provider] = ProviderLimiter(**PROVIDER_RATE_LIMITS.get(provider, DEFAULT_RATE_LIMIT))
+    return limiter
@@ -0,0 +1,220 @@
+import asyncio
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+from services.llm_router import generate_text_with_provider, is_failure, primary_model
+from db.tag_cache import get_cached_tags, get_cached_tags_many, put_cached_tags, tag_cache_key
+from app.loger_setup import get_logger
+
+logger = get_logger(__name__, level="INFO")
+
+TAG_RETRIES = 3
+# Портфолио в одном запросе: ответ на пачку должен уложиться в max_tokens модели
+PROMPT_BATCH_SIZE = 8
+RETRY_BACKOFF_SECONDS = 2.0
+
+
+class TaggingError(Exception):
+    """Модель недоступна или вернула не тот JSON — запрос имеет смысл повторить."""
+
+
+def load_known_tags():
+    if not os.path.exists("known_tags.json"):
+        return []
+    with open("known_tags.json", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_known_tags(tags: list[str]):
+    with open("known_tags.json", "w", encoding="utf-8") as f:
+        json.dump(sorted(set(tags)), f, ensure_ascii=False, indent=2)
+
+
+def update_known_tags(new_tags: list[str]):
+    known = set(load_known_tags())
+    updated = known.union(new_tags)
+    save_known_tags(list(updated))
+
+
+def load_tags_template(key: str = "generate_tags") -> str:
+    with open("prompts.json", "r", encoding="utf-8") as f:
+        return json.load(f)[key]
+
+
+def prompt_version(template: str) -> str:
+    # Правка промпта в prompts.json автоматически делает старые записи кэша недостижимыми
+    return hashlib.sha256(template.encode("utf-8")).hexdigest()[:12]
+
+
+def build_tags_prompt(template: str, portfolio_text: str) -> str:
+    known_tags_str = ", ".join(load_known_tags())
+    return f"{template}Известные теги: {known_tags_str}\n\nВот портфолио:\n{portfolio_text}"
+
+
+def build_batch_prompt(template: str, batch_template: str, portfolios: Dict[int, str]) -> str:
+    # Общая часть промпта и список известных тегов — один раз на всю пачку
+    known_tags_str = ", ".join(load_known_tags())
+    items = "\n\n".join(f"user_id: {user_id}\n{text}" for user_id, text in portfolios.items())
+    return f"{template}\n\n{batch_template}Известные теги: {known_tags_str}\n\nВот портфолио:\n{items}"
+
+
+def _valid_tags_item(item) -> Optional[Tuple[List[str], bool]]:
+    """Теги и mean из объекта ответа модели или None, если форма не та (tags — строка, mean — не список и т.п.)."""
+    if not isinstance(item, dict):
+        return None
+    tags, mean = item.get("tags"), item.get("mean")
+    if (
+        not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags)
+        or not isinstance(mean, list) or not mean or mean[0] not in ("True", "False")
+    ):
+        return None
+    return tags, mean[0] == "True"
+
+
+def parse_batch_response(response_text: str, user_ids: Iterable[int]) -> Dict[int, Tuple[List[str], bool]]:
+    """Разбирает JSON-массив пачки; в результат попадают только корректные элементы с ожидаемыми user_id."""
+    expected = set(user_ids)
+    try:
+        parsed = json.loads(response_text)
+    except (ValueError, TypeError):
+        return {}
+    if not isinstance(parsed, list):
+        return {}
+
+    results = {}
+    for item in parsed:
+        if not isinstance(item, dict):
+            continue
+        try:
+            user_id = int(item.get("user_id"))
+        except (TypeError, ValueError):
+            continue
+        parsed_item = _valid_tags_item(item)
+        if user_id not in expected or user_id in results or parsed_item is None:
+            continue
+        results[user_id] = parsed_item
+    return results
+
+
+def parse_tags_response(response_text: str) -> Tuple[List[str], bool]:
+    # Непроверенный ответ попал бы в tag_cache навсегда, поэтому форма проверяется строго
+    try:
+        parsed = json.loads(response_text)
+    except (ValueError, TypeError) as e:
+        raise TaggingError(f"Некорректный ответ модели: {e}; {str(response_text)[:200]!r}") from e
+    result = _valid_tags_item(parsed)
+    if result is None:
+        raise TaggingError(f"Некорректная структура ответа модели: {str(response_text)[:200]!r}")
+    return result
+
+
+async def request_tags(prompt: str, hedge: bool = False) -> Tuple[List[str], bool, str]:
+    """Один запрос через роутер провайдеров (лимиты — внутри): теги, mean и модель, которая ответила.
+
+    TaggingError, если ответ не разобрать.
+    """
+    response_text, provider = await generate_text_with_provider(prompt, hedge=hedge)
+    tags, is_meaningful = parse_tags_response(response_text)
+    return tags, is_meaningful, provider.model
+
+
+async def extract_tags(portfolio_text: str, retries: int = 1, hedge: bool = False) -> Tuple[List[str], bool]:
+    """Теги портфолио: сначала кэш по содержимому, затем модель с повторами и экспоненциальной паузой.
+
+    После последней неудачной попытки пробрасывает TaggingError. Список известных тегов в ключ кэша
+    не входит: иначе каждый новый тег обнулял бы кэш. Ищется запись основной модели роутера,
+    а сохраняется под моделью, которая на самом деле ответила: ответ резервного провайдера
+    не должен выдаваться за ответ основного.
+    """
+    template = load_tags_template()
+    version = prompt_version(template)
+    cached = await get_cached_tags(tag_cache_key(portfolio_text, version, primary_model()))
+    if cached is not None:
+        return cached
+
+    prompt = build_tags_prompt(template, portfolio_text)
+    for attempt in range(retries):
+        try:
+            tags, is_meaningful, model = await request_tags(prompt, hedge)
+            break
+        except TaggingError as e:
+            if attempt == retries - 1:
+                raise
+            logger.warning(f"Повтор {attempt + 1}/{retries - 1} генерации тегов: {e}")
+            await asyncio.sleep(RETRY_BACKOFF_SECONDS * 2 ** attempt)
+
+    await put_cached_tags(tag_cache_key(portfolio_text, version, model), tags, is_meaningful, model, version)
+    return tags, is_meaningful
+
+
+async def extract_tags_batch(
+        portfolios: Dict[int, str], retries: int = TAG_RETRIES
+) -> Tuple[Dict[int, Tuple[List[str], bool]], Dict[int, TaggingError]]:
+    """Теги для пачки портфолио (до PROMPT_BATCH_SIZE, делит вызывающий): кэш, затем один запрос.
+
+    Если модели недоступны, повторяется запрос всей пачки, а не каждого портфолио отдельно;
+    после retries неудач все портфолио пачки уходят в ошибки. По одному через extract_tags
+    переспрашиваются только элементы, которых нет в полученном ответе или которые не прошли
+    проверку. Возвращает (теги по user_id, ошибки по user_id). Ответы пачки кэшируются отдельно
+    от одиночных: в версии — оба шаблона, так что правка generate_tags_batch тоже сбрасывает кэш.
+    Модель в ключе — та, что на самом деле ответила.
+    """
+    template = load_tags_template()
+    batch_template = load_tags_template("generate_tags_batch")
+    version = prompt_version(template + batch_template)
+    model = primary_model()
+
+    results: Dict[int, Tuple[List[str], bool]] = {}
+    failed: Dict[int, TaggingError] = {}
+    keys = {user_id: tag_cache_key(text, version, model) for user_id, text in portfolios.items()}
+    cached = await get_cached_tags_many(list(keys.values()))
+    misses = {}
+    for user_id, text in portfolios.items():
+        if keys[user_id] in cached:
+            results[user_id] = cached[keys[user_id]]
+        else:
+            misses[user_id] = text
+    if not misses:
+        return results, failed
+
+    prompt = build_batch_prompt(template, batch_template, misses)
+    for attempt in range(retries):
+        response_text, provider = await generate_text_with_provider(prompt)
+        if not is_failure(response_text):
+            break
+        if attempt < retries - 1:
+            logger.warning(f"Повтор {attempt + 1}/{retries - 1} пачки из {len(misses)}: {response_text!r}")
+            await asyncio.sleep(RETRY_BACKOFF_SECONDS * 2 ** attempt)
+    else:
+        error = TaggingError(f"Модели недоступны: {response_text!r}")
+        return results, {user_id: error for user_id in misses}
+
+    parsed = parse_batch_response(response_text, misses)
+    answered_model = provider.model
+    for user_id, (tags, is_meaningful) in parsed.items():
+        results[user_id] = (tags, is_meaningful)
+        key = keys[user_id] if answered_model == model else tag_cache_key(misses[user_id], version, answered_model)
+        await put_cached_tags(key, tags, is_meaningful, answered_model, version)
+
+    rest = [user_id for user_id in misses if user_id not in parsed]
+    if rest:
+        logger.warning(f"Пачка из {len(misses)}: {len(rest)} портфолио переспрашиваю по одному")
+    for user_id in rest:
+        try:
+            results[user_id] = await extract_tags(misses[user_id], retries)
+        except TaggingError as e:
+            failed[user_id] = e
+    return results, failed
+
+
+async def process_portfolio_with_ai(portfolio_text: str) -> tuple[list[str], bool]:
+    """Теги портфолио для интерактивных сценариев: при любой ошибке — ([], False).
+
+    Пользователь ждёт ответа, поэтому медленный запрос хеджируется вторым провайдером.
+    """
+    try:
+        return await extract_tags(portfolio_text, hedge=True)
+    except Exception as e:
+        logger.error(f"JSON parsing error: {e}")
+        return [], False
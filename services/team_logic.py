@@ -0,0 +1,833 @@
+import heapq
+import multiprocessing
+import os
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, Hashable, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+
+class TagBitIndex:
+    """Назначает каждому тегу номер бита, чтобы наборы тегов хранились как обычные int.
+
+    Пересечение наборов тогда — это `a & b`, а число конфликтов — `(a & b).bit_count()`,
+    без создания промежуточных множеств. id тегов стабильны, поэтому одно и то же
+    отображение можно переиспользовать между запусками распределения.
+    """
+
+    def __init__(self):
+        self._bits: Dict[Hashable, int] = {}
+        self._tags: List[Hashable] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._tags)
+
+    def bit(self, tag: Hashable) -> int:
+        bit = self._bits.get(tag)
+        if bit is None:
+            with self._lock:
+                bit = self._bits.get(tag)
+                if bit is None:
+                    bit = len(self._tags)
+                    self._tags.append(tag)
+                    self._bits[tag] = bit
+        return bit
+
+    def mask(self, tags: Iterable[Hashable]) -> int:
+        mask = 0
+        for tag in tags:
+            mask |= 1 << self.bit(tag)
+        return mask
+
+    def decode(self, mask: int) -> List[Hashable]:
+        """Обратное преобразование: теги, чьи биты выставлены в маске."""
+        tags = []
+        while mask:
+            low = mask & -mask
+            tags.append(self._tags[low.bit_length() - 1])
+            mask ^= low
+        return tags
+
+
+def conflict_count(team_mask: int, user_mask: int) -> int:
+    return (team_mask & user_mask).bit_count()
+
+
+# Общее для всех распределений отображение id тега -> бит
+tag_bits = TagBitIndex()
+
+
+class Placement(NamedTuple):
+    team: int  # индекс команды в списке teams, переданном планировщику
+    conflicts: int  # сколько тегов пользователя уже было в команде
+    overflow: bool  # команда была заполнена до max_team_size
+
+
+def pick_new_team_color(teams: List[dict], color_limits: Dict[str, int]) -> Optional[str]:
+    """Цвет с наименьшим числом команд, у которого ещё не исчерпан лимит, или None."""
+    color_counts = {}
+    for team in teams:
+        color = team["color"]
+        if color_limits.get(color, 0) > 0:
+            color_counts[color] = color_counts.get(color, 0) + 1
+
+    available_colors = [color for color, limit in color_limits.items()
+                        if limit > 0 and color_counts.get(color, 0) < limit]
+    if not available_colors:
+        return None
+    return min(available_colors, key=lambda c: color_counts.get(c, 0))
+
+
+def plan_greedy(user_tags: Sequence[Sequence[int]], teams: List[dict], color_limits: Dict[str, int],
+                max_team_size: int, progress: Optional[Callable[[int, int], None]] = None) -> List[Optional[Placement]]:
+    """Жадно раскладывает пользователей по командам, не трогая базу.
+
+    user_tags — id тегов каждого пользователя (например, срезы колонок ParticipantSnapshot);
+    teams — словари с "id", "color", "members", "tags".
+    Счётчики members в teams обновляются на месте; если лимит цвета позволяет, в конец teams
+    добавляются новые команды с "id": None — их создаёт вызывающий код.
+    """
+    team_masks = [tag_bits.mask(team["tags"]) for team in teams]
+    placements = []
+    progress_step = max(1, len(user_tags) // 20)
+
+    for done, tags in enumerate(user_tags, 1):
+        if progress and done % progress_step == 0:
+            progress(done, len(user_tags))
+
+        user_mask = tag_bits.mask(tags)
+        best = None
+        min_conflicts = float('inf')
+        min_members = float('inf')
+
+        # 1. Первая команда без конфликтов (со свободными местами)
+        for i, team in enumerate(teams):
+            if team["members"] < max_team_size and not team_masks[i] & user_mask:
+                best = i
+                break
+
+        # 2. Команда с минимальными конфликтами (со свободными местами)
+        if best is None:
+            for i, team in enumerate(teams):
+                if team["members"] >= max_team_size:
+                    continue
+
+                conflicts = conflict_count(team_masks[i], user_mask)
+                if conflicts < min_conflicts or (conflicts == min_conflicts and team["members"] < min_members):
+                    best = i
+                    min_conflicts = conflicts
+                    min_members = team["members"]
+
+        # 3. Если все команды переполнены, любая с минимальными конфликтами (только цвета с лимитом)
+        if best is None:
+            eligible = [i for i, team in enumerate(teams) if color_limits.get(team["color"], 0) > 0]
+            if eligible:
+                best = min(eligible, key=lambda i: (conflict_count(team_masks[i], user_mask), teams[i]["members"]))
+
+        # 4. Новая команда, если лимит цвета позволяет
+        if best is None or teams[best]["members"] >= max_team_size:
+            color = pick_new_team_color(teams, color_limits)
+            if color is not None:
+                teams.append({"id": None, "color": color, "members": 0, "tags": []})
+                team_masks.append(0)
+                best = len(teams) - 1
+
+        if best is None:
+            placements.append(None)
+            continue
+
+        placements.append(Placement(
+            team=best,
+            conflicts=conflict_count(team_masks[best], user_mask),
+            overflow=teams[best]["members"] >= max_team_size,
+        ))
+        team_masks[best] |= user_mask
+        teams[best]["members"] += 1
+
+    return placements
+
+
+VECTOR_BATCH_SIZE = 512
+
+
+def plan_vectorized(user_tags: Sequence[Sequence[int]], teams: List[dict], color_limits: Dict[str, int],
+                    max_team_size: int, progress: Optional[Callable[[int, int], None]] = None,
+                    batch_size: int = VECTOR_BATCH_SIZE) -> List[Optional[Placement]]:
+    """То же, что plan_greedy, но конфликты пачки пользователей со всеми командами считаются
+    одним матричным произведением (пользователь×тег @ тег×команда).
+
+    Внутри пачки после каждого назначения пересчитывается только столбец выбранной команды,
+    поэтому результат совпадает с plan_greedy один в один. Нужен numpy.
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        raise RuntimeError("Для векторного режима распределения нужен numpy (pip install numpy)")
+
+    user_columns = [[tag_bits.bit(tag) for tag in tags] for tags in user_tags]
+    team_columns = [[tag_bits.bit(tag) for tag in team["tags"]] for team in teams]
+    width = max(len(tag_bits), 1)
+
+    # float32: произведение уходит в BLAS, а счётчики тегов точно представимы
+    team_has = np.zeros((len(teams), width), dtype=np.float32)
+    for i, columns in enumerate(team_columns):
+        team_has[i, columns] = 1
+    members = np.array([team["members"] for team in teams], dtype=np.int64)
+    eligible = np.array([color_limits.get(team["color"], 0) > 0 for team in teams], dtype=bool)
+    closed_key = np.iinfo(np.int64).max
+    key_scale = len(user_tags) + int(members.max(initial=0)) + 1
+
+    placements = []
+    progress_step = max(1, len(user_tags) // 20)
+
+    for start in range(0, len(user_tags), batch_size):
+        batch = user_columns[start:start + batch_size]
+        batch_matrix = np.zeros((len(batch), width), dtype=np.float32)
+        for row, columns in enumerate(batch):
+            batch_matrix[row, columns] = 1
+        conflicts = (batch_matrix @ team_has.T).astype(np.int64)
+
+        for row in range(len(batch)):
+            done = start + row + 1
+            if progress and done % progress_step == 0:
+                progress(done, len(user_tags))
+
+            user_conflicts = conflicts[row]
+            is_open = members < max_team_size
+            best = None
+
+            if is_open.any():
+                # 1. Первая открытая команда без конфликтов, иначе 2. минимум (конфликты, участники)
+                free = np.flatnonzero(is_open & (user_conflicts == 0))
+                if free.size:
+                    best = int(free[0])
+                else:
+                    best = int(np.argmin(np.where(is_open, user_conflicts * key_scale + members, closed_key)))
+            elif eligible.any():
+                # 3. Все заполнены — минимум среди цветов с лимитом
+                best = int(np.argmin(np.where(eligible, user_conflicts * key_scale + members, closed_key)))
+
+            # 4. Новая команда, если лимит цвета позволяет
+            if best is None or members[best] >= max_team_size:
+                color = pick_new_team_color(teams, color_limits)
+                if color is not None:
+                    teams.append({"id": None, "color": color, "members": 0, "tags": []})
+                    team_has = np.vstack([team_has, np.zeros((1, width), dtype=np.float32)])
+                    members = np.append(members, 0)
+                    eligible = np.append(eligible, True)
+                    conflicts = np.hstack([conflicts, np.zeros((len(batch), 1), dtype=np.int64)])
+                    best = len(teams) - 1
+
+            if best is None:
+                placements.append(None)
+                continue
+
+            placements.append(Placement(
+                team=best,
+                conflicts=int(conflicts[row, best]),
+                overflow=bool(members[best] >= max_team_size),
+            ))
+
+            # Новые для команды теги увеличивают конфликты оставшихся в пачке с этой командой
+            added = [column for column in batch[row] if not team_has[best, column]]
+            if added:
+                conflicts[row + 1:, best] += batch_matrix[row + 1:, added].sum(axis=1, dtype=np.int64)
+                team_has[best, added] = 1
+            members[best] += 1
+            teams[best]["members"] += 1
+
+    return placements
+
+
+REGISTRY_LOOKAHEAD = 32
+
+
+class TeamRegistry:
+    """Индекс команд плана: куча открытых команд по (участники, позиция), куча заполненных
+    команд (для переполнения) и счётчики команд по цветам — всё обновляется при назначениях.
+
+    Кандидаты достаются из кучи от наименее заполненных; первая команда без конфликтов
+    сразу выигрывает, иначе берётся минимум (конфликты, участники, позиция) среди
+    первых lookahead кандидатов. Поиск стоит O(lookahead · log teams) вместо O(teams).
+    """
+
+    def __init__(self, teams: List[dict], color_limits: Dict[str, int], max_team_size: int,
+                 lookahead: Optional[int] = REGISTRY_LOOKAHEAD):
+        self.teams = teams
+        self.color_limits = color_limits
+        self.max_team_size = max_team_size
+        self.lookahead = lookahead
+        self.masks: List[int] = []
+        self.color_counts: Dict[str, int] = {}
+        self._open: List[tuple] = []
+        self._full: List[tuple] = []
+        for i, team in enumerate(teams):
+            self._index(i, team)
+            self._enqueue(i, push=False)
+        heapq.heapify(self._open)
+        heapq.heapify(self._full)
+
+    def _index(self, i: int, team: dict):
+        self.masks.append(tag_bits.mask(team["tags"]))
+        color = team["color"]
+        if self.color_limits.get(color, 0) > 0:
+            self.color_counts[color] = self.color_counts.get(color, 0) + 1
+
+    def _enqueue(self, i: int, push: bool = True):
+        members = self.teams[i]["members"]
+        if members < self.max_team_size:
+            heap = self._open
+        elif self.color_limits.get(self.teams[i]["color"], 0) > 0:
+            heap = self._full
+        else:
+            return
+        if push:
+            heapq.heappush(heap, (members, i))
+        else:
+            heap.append((members, i))
+
+    def _best_in(self, heap: List[tuple], user_mask: int) -> Optional[int]:
+        popped = []
+        best_key = None
+        while heap and (self.lookahead is None or len(popped) < self.lookahead):
+            members, i = heapq.heappop(heap)
+            popped.append((members, i))
+            key = (conflict_count(self.masks[i], user_mask), members, i)
+            if best_key is None or key < best_key:
+                best_key = key
+            if key[0] == 0:
+                break
+        for entry in popped:
+            if best_key is None or entry[1] != best_key[2]:
+                heapq.heappush(heap, entry)
+        return best_key[2] if best_key else None
+
+    def available_color(self) -> Optional[str]:
+        available = [color for color, limit in self.color_limits.items()
+                     if limit > 0 and self.color_counts.get(color, 0) < limit]
+        if not available:
+            return None
+        return min(available, key=lambda c: self.color_counts.get(c, 0))
+
+    def add_team(self, color: str) -> int:
+        """Добавляет пустую команду (её id назначит вызывающий код); в кучу она попадёт при назначении."""
+        self.teams.append({"id": None, "color": color, "members": 0, "tags": []})
+        i = len(self.teams) - 1
+        self._index(i, self.teams[i])
+        return i
+
+    def place(self, user_mask: int) -> Optional[Placement]:
+        """Выбирает команду для пользователя и сразу учитывает его в индексе."""
+        best = self._best_in(self._open, user_mask)
+        if best is None:
+            # Все команды заполнены: новая команда, если лимит цвета позволяет, иначе переполнение
+            color = self.available_color()
+            if color is not None:
+                best = self.add_team(color)
+            else:
+                best = self._best_in(self._full, user_mask)
+        if best is None:
+            return None
+
+        team = self.teams[best]
+        placement = Placement(
+            team=best,
+            conflicts=conflict_count(self.masks[best], user_mask),
+            overflow=team["members"] >= self.max_team_size,
+        )
+        self.masks[best] |= user_mask
+        team["members"] += 1
+        self._enqueue(best)
+        return placement
+
+
+def plan_indexed(user_tags: Sequence[Sequence[int]], teams: List[dict], color_limits: Dict[str, int],
+                 max_team_size: int, progress: Optional[Callable[[int, int], None]] = None,
+                 lookahead: Optional[int] = REGISTRY_LOOKAHEAD) -> List[Optional[Placement]]:
+    """Планировщик на TeamRegistry: команды заполняются равномерно, стоимость ~O(users · log teams)."""
+    registry = TeamRegistry(teams, color_limits, max_team_size, lookahead)
+    placements = []
+    progress_step = max(1, len(user_tags) // 20)
+
+    for done, tags in enumerate(user_tags, 1):
+        if progress and done % progress_step == 0:
+            progress(done, len(user_tags))
+        placements.append(registry.place(tag_bits.mask(tags)))
+
+    return placements
+
+
+def replay_conflicts(user_tags: Sequence[Sequence[int]], teams: List[dict],
+                     placements: List[Optional[Placement]]) -> List[int]:
+    """Маски конфликтующих тегов каждого пользователя при вступлении в команды в порядке user_tags.
+
+    Для результата жадного прохода совпадает с Placement.conflicts; после перестановок
+    сумма по всем пользователям равна итоговому числу конфликтов.
+    """
+    team_masks = [tag_bits.mask(team["tags"]) for team in teams]
+    result = []
+    for tags, placement in zip(user_tags, placements):
+        if placement is None:
+            result.append(0)
+            continue
+        user_mask = tag_bits.mask(tags)
+        result.append(team_masks[placement.team] & user_mask)
+        team_masks[placement.team] |= user_mask
+    return result
+
+
+SEARCH_CANDIDATES = 16
+SEARCH_STALL_FACTOR = 20
+
+
+class SearchReport(NamedTuple):
+    conflicts_before: int
+    conflicts_after: int
+    moves: int
+    swaps: int
+    elapsed: float
+
+
+def improve_placements(user_tags: Sequence[Sequence[int]], teams: List[dict],
+                       placements: List[Optional[Placement]], max_team_size: int, time_budget: float,
+                       seed: Optional[int] = None) -> Tuple[List[Optional[Placement]], SearchReport]:
+    """Локальный поиск после жадного прохода: переносы и обмены участников между командами,
+    пока они уменьшают суммарное число конфликтов и не вышло time_budget секунд.
+
+    Конфликты команды — сумма по тегам (число носителей - 1); теги участников, уже сидевших
+    в команде до запуска, считаются одним неподвижным носителем. Изменение стоимости
+    считается инкрементально по счётчикам тегов двух затронутых команд. Переносы не
+    превышают max_team_size, обмены не меняют размеры, набор команд и их цвета не меняются.
+    teams["members"] обновляется на месте.
+    """
+    started = time.monotonic()
+    deadline = started + time_budget
+    rnd = random.Random(seed)
+
+    counts = [Counter(team["tags"]) for team in teams]
+    members = [[] for _ in teams]
+    unique_tags = [list(dict.fromkeys(tags)) for tags in user_tags]
+    team_of = [placement.team if placement else None for placement in placements]
+    for u, team in enumerate(team_of):
+        if team is not None:
+            members[team].append(u)
+            counts[team].update(unique_tags[u])
+
+    def team_cost(c: Counter) -> int:
+        return sum(n - 1 for n in c.values() if n > 1)
+
+    def removal_gain(team: int, u: int) -> int:
+        c = counts[team]
+        return sum(1 for tag in unique_tags[u] if c[tag] >= 2)
+
+    def addition_cost(team: int, u: int, without: Optional[int] = None) -> int:
+        c = counts[team]
+        skip = set(unique_tags[without]) if without is not None else ()
+        return sum(1 for tag in unique_tags[u] if c[tag] - (tag in skip) >= 1)
+
+    def relocate(u: int, source: int, target: int):
+        members[source].remove(u)
+        counts[source].subtract(unique_tags[u])
+        members[target].append(u)
+        counts[target].update(unique_tags[u])
+        team_of[u] = target
+
+    before = sum(team_cost(c) for c in counts)
+    current = before
+    movable = [u for u, team in enumerate(team_of) if team is not None]
+    moves = swaps = 0
+    candidates = min(len(teams) - 1, SEARCH_CANDIDATES)
+    # Долго нет улучшений — скорее всего локальный минимум, дальше бюджет не тратим
+    stall_limit = SEARCH_STALL_FACTOR * len(movable)
+    stalled = 0
+
+    while movable and current > 0 and candidates > 0 and stalled < stall_limit and time.monotonic() < deadline:
+        stalled += 1
+        u = rnd.choice(movable)
+        source = team_of[u]
+        gain = removal_gain(source, u)
+        if gain == 0:
+            continue
+
+        best_delta, best_move = 0, None
+        for target in rnd.sample(range(len(teams)), candidates + 1):
+            if target == source:
+                continue
+            if teams[target]["members"] < max_team_size:
+                delta = addition_cost(target, u) - gain
+                if delta < best_delta:
+                    best_delta, best_move = delta, (target, None)
+            if members[target]:
+                v = rnd.choice(members[target])
+                delta = (addition_cost(target, u, without=v) + addition_cost(source, v, without=u)
+                         - gain - removal_gain(target, v))
+                if delta < best_delta:
+                    best_delta, best_move = delta, (target, v)
+
+        if best_move is None:
+            continue
+        stalled = 0
+        target, v = best_move
+        relocate(u, source, target)
+        if v is None:
+            teams[source]["members"] -= 1
+            teams[target]["members"] += 1
+            moves += 1
+        else:
+            relocate(v, target, source)
+            swaps += 1
+        current += best_delta
+
+    improved = [
+        Placement(team=team_of[u], conflicts=0, overflow=placement.overflow) if placement else None
+        for u, placement in enumerate(placements)
+    ]
+    conflict_masks = replay_conflicts(user_tags, teams, improved)
+    improved = [
+        placement._replace(conflicts=mask.bit_count()) if placement else None
+        for placement, mask in zip(improved, conflict_masks)
+    ]
+    return improved, SearchReport(before, current, moves, swaps, time.monotonic() - started)
+
+
+class RestartReport(NamedTuple):
+    runs: int
+    best_seed: int
+    conflicts: List[int]  # итоговые конфликты каждого прогона, по seed
+    search: Optional[SearchReport]  # локальный поиск лучшего прогона
+
+
+# Снимок входных данных в процессе-воркере: передаётся один раз через initializer, а не с каждой задачей
+_snapshot: Optional[tuple] = None
+
+
+def _init_restart_worker(user_tags: List[list], teams: List[dict], color_limits: Dict[str, int], max_team_size: int):
+    global _snapshot
+    _snapshot = (user_tags, teams, color_limits, max_team_size)
+
+
+def restart_order(user_tags: List[list], seed: int) -> List[int]:
+    """Порядок обхода пользователей для прогона seed.
+
+    0 — исходный порядок, нечётные — случайная перестановка, чётные — сначала
+    пользователи с большим числом тегов (их сложнее всего разместить), ничьи в случайном порядке.
+    """
+    order = list(range(len(user_tags)))
+    if seed == 0:
+        return order
+    rnd = random.Random(seed)
+    rnd.shuffle(order)
+    if seed % 2 == 0:
+        order.sort(key=lambda i: -len(user_tags[i]))
+    return order
+
+
+def _run_restart(seed: int, mode: str, optimize_seconds: float):
+    user_tags, snapshot_teams, color_limits, max_team_size = _snapshot
+    order = restart_order(user_tags, seed)
+    ordered = [user_tags[i] for i in order]
+    teams = [dict(team) for team in snapshot_teams]
+
+    planned = PLANNERS[mode](ordered, teams, color_limits, max_team_size)
+    search = None
+    if optimize_seconds > 0:
+        planned, search = improve_placements(ordered, teams, planned, max_team_size, optimize_seconds, seed=seed)
+
+    placements: List[Optional[Placement]] = [None] * len(order)
+    for i, placement in zip(order, planned):
+        placements[i] = placement
+    unplaced = sum(1 for placement in planned if placement is None)
+    conflicts = sum(placement.conflicts for placement in planned if placement)
+    return (unplaced, conflicts, seed), placements, teams, search
+
+
+def plan_restarts(user_tags: Sequence[Sequence[int]], teams: List[dict], color_limits: Dict[str, int],
+                  max_team_size: int, restarts: int, mode: str = "indexed", optimize_seconds: float = 0.0,
+                  workers: Optional[int] = None,
+                  progress: Optional[Callable[[int, int], None]] = None
+                  ) -> Tuple[List[Optional[Placement]], RestartReport]:
+    """Запускает restarts прогонов планировщика mode с разным порядком пользователей в пуле процессов
+    и возвращает лучший: меньше всего неразмещённых, затем меньше всего конфликтов.
+
+    Воркеры получают только теги пользователей и команды. teams заменяется на месте командами
+    лучшего прогона (включая новые с "id": None), placements — в исходном порядке user_tags.
+    """
+    # Срезы колонок снимка (memoryview) не сериализуются — воркерам уходят списки
+    tag_lists = [list(tags) for tags in user_tags]
+    workers = min(restarts, workers or os.cpu_count() or 1)
+    # spawn: распределение запускается из потока рядом с event loop, fork там небезопасен
+    context = multiprocessing.get_context("spawn")
+
+    best = None
+    conflicts: Dict[int, int] = {}
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_restart_worker,
+                             initargs=(tag_lists, teams, color_limits, max_team_size)) as pool:
+        futures = [pool.submit(_run_restart, seed, mode, optimize_seconds) for seed in range(restarts)]
+        for done, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            key = result[0]
+            conflicts[key[2]] = key[1]
+            if best is None or key < best[0]:
+                best = result
+            if progress:
+                progress(len(user_tags) * done // restarts, len(user_tags))
+
+    (_, _, best_seed), placements, best_teams, search = best
+    teams[:] = best_teams
+    return placements, RestartReport(restarts, best_seed, [conflicts[seed] for seed in range(restarts)], search)
+
+
+class Move(NamedTuple):
+    user_id: int
+    source: int  # id команды, из которой уходит участник
+    target: int
+
+
+def plan_rebalance(teams: Dict[int, List[Tuple[int, List[int]]]], max_team_size: int) -> List[Move]:
+    """Минимальный набор переносов, возвращающий размеры команд в границы
+    [участников // команд, max(max_team_size, ⌈участников / команд⌉)].
+
+    teams — {team_id: [(user_id, теги), ...]} только актуальных участников. Целевой размер
+    команды — её текущий размер, прижатый к границам; лишние/недостающие места снимаются
+    и добавляются сначала у самых больших команд, так что переносов ровно столько, сколько
+    требуют границы. Из команды уходит участник с наибольшим числом конфликтов в ней,
+    а попадает туда, где добавит меньше всего новых.
+    """
+    if not teams:
+        return []
+    total = sum(len(members) for members in teams.values())
+    low = total // len(teams)
+    high = max(max_team_size, -(-total // len(teams)))
+    by_size = sorted(teams, key=lambda team_id: (-len(teams[team_id]), team_id))
+    targets = {team_id: min(max(len(teams[team_id]), low), high) for team_id in by_size}
+
+    surplus = sum(targets.values()) - total
+    for team_id in by_size:
+        if surplus > 0:
+            cut = min(surplus, targets[team_id] - low)
+            targets[team_id] -= cut
+            surplus -= cut
+        elif surplus < 0:
+            add = min(-surplus, high - targets[team_id])
+            targets[team_id] += add
+            surplus += add
+
+    counts = {team_id: Counter(tag for _, tags in members for tag in set(tags)) for team_id, members in teams.items()}
+    members = {team_id: list(team_members) for team_id, team_members in teams.items()}
+    receivers = [team_id for team_id in by_size if len(members[team_id]) < targets[team_id]]
+    moves = []
+
+    for source in by_size:
+        while len(members[source]) > targets[source]:
+            c = counts[source]
+            # Кого отдаём: больше всего тегов, которые в команде встречаются повторно
+            leaving = max(members[source], key=lambda m: sum(1 for tag in set(m[1]) if c[tag] >= 2))
+            open_receivers = [team_id for team_id in receivers if len(members[team_id]) < targets[team_id]]
+            if not open_receivers:
+                return moves
+            target = min(open_receivers, key=lambda team_id: (
+                sum(1 for tag in set(leaving[1]) if counts[team_id][tag] >= 1), len(members[team_id])
+            ))
+
+            members[source].remove(leaving)
+            counts[source].subtract(set(leaving[1]))
+            members[target].append(leaving)
+            counts[target].update(set(leaving[1]))
+            moves.append(Move(leaving[0], source, target))
+
+    return moves
+
+
+SHARD_FIXUP_SECONDS = 1.0
+
+
+def shard_users(user_tags: Sequence[Sequence[int]], quotas: Dict[Hashable, int]) -> Dict[Hashable, List[int]]:
+    """Раскладывает индексы user_tags по шардам пропорционально quotas, перемежая их по исходному порядку."""
+    shards: Dict[Hashable, List[int]] = {key: [] for key, quota in quotas.items() if quota > 0}
+    if not shards:
+        return shards
+    for i in range(len(user_tags)):
+        key = min(shards, key=lambda k: (len(shards[k]) + 1) / quotas[k])
+        shards[key].append(i)
+    return shards
+
+
+def _plan_shard(user_tags: List[list], teams: List[dict], color_limits: Dict[str, int], max_team_size: int,
+                mode: str):
+    placements = PLANNERS[mode](user_tags, teams, color_limits, max_team_size)
+    return placements, teams
+
+
+def plan_sharded(user_tags: Sequence[Sequence[int]], teams: List[dict], color_limits: Dict[str, int],
+                 max_team_size: int, progress: Optional[Callable[[int, int], None]] = None, mode: str = "indexed",
+                 workers: Optional[int] = None,
+                 fixup_seconds: float = SHARD_FIXUP_SECONDS) -> List[Optional[Placement]]:
+    """Делит пользователей на шарды по цветам пропорционально квоте (лимит цвета · max_team_size),
+    распределяет каждый шард планировщиком mode в своём процессе и склеивает результат.
+
+    После склейки — короткий локальный поиск по всем командам (fixup_seconds), который
+    переносит и меняет участников между шардами. Новые команды, как и в остальных
+    планировщиках, добавляются в конец teams с "id": None.
+    """
+    colors = [color for color, limit in color_limits.items() if limit > 0]
+    if len(colors) < 2:
+        return PLANNERS[mode](user_tags, teams, color_limits, max_team_size, progress)
+
+    shards = shard_users(user_tags, {color: color_limits[color] * max_team_size for color in colors})
+    team_index = {color: [i for i, team in enumerate(teams) if team["color"] == color] for color in shards}
+    context = multiprocessing.get_context("spawn")
+    workers = min(len(shards), workers or os.cpu_count() or 1)
+
+    placements: List[Optional[Placement]] = [None] * len(user_tags)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = {
+            pool.submit(_plan_shard, [list(user_tags[i]) for i in user_ids],
+                        [teams[i] for i in team_index[color]], {color: color_limits[color]}, max_team_size, mode): color
+            for color, user_ids in shards.items()
+        }
+        done = 0
+        for future in as_completed(futures):
+            color = futures[future]
+            shard_placements, shard_teams = future.result()
+            # Команды шарда: сначала уже существовавшие (по месту), затем новые — в конец общего списка
+            global_index = list(team_index[color])
+            for shard_team in shard_teams[len(global_index):]:
+                teams.append(shard_team)
+                global_index.append(len(teams) - 1)
+            for i, shard_team in zip(team_index[color], shard_teams):
+                teams[i] = shard_team
+            for user_i, placement in zip(shards[color], shard_placements):
+                if placement is not None:
+                    placements[user_i] = placement._replace(team=global_index[placement.team])
+            done += len(shards[color])
+            if progress:
+                progress(done, len(user_tags))
+
+    if fixup_seconds > 0:
+        placements, _ = improve_placements(user_tags, teams, placements, max_team_size, fixup_seconds)
+    return placements
+
+
+# "greedy" — эталонный линейный перебор, "vectorized" повторяет его на numpy,
+# "indexed" — быстрый режим по умолчанию с равномерным заполнением команд,
+# "sharded" — параллельно по цветам (внутри — "indexed") со сшивающим локальным поиском
+PLANNERS = {
+    "indexed": plan_indexed,
+    "greedy": plan_greedy,
+    "vectorized": plan_vectorized,
+    "sharded": plan_sharded,
+}
+
+
+class SweepConfig(NamedTuple):
+    color_limits: Dict[str, int]  # число команд каждого цвета
+    max_team_size: int
+    mode: str = "indexed"
+
+    @property
+    def num_teams(self) -> int:
+        return sum(max(limit, 0) for limit in self.color_limits.values())
+
+
+class SweepRow(NamedTuple):
+    config: SweepConfig
+    teams: int
+    placed: int
+    unplaced: int
+    overflow: int
+    conflicts: int
+    fill_rate: float  # размещённые / (команд · max_team_size)
+    seconds: float
+
+
+def make_sweep_grid(team_counts: Iterable[int], team_sizes: Iterable[int], colors: List[str],
+                    modes: Iterable[str] = ("indexed",)) -> List[SweepConfig]:
+    """Все сочетания числа команд, размера и режима; команды делятся между colors поровну."""
+    grid = []
+    for mode in modes:
+        for num_teams in team_counts:
+            per_color, extra = divmod(num_teams, len(colors))
+            color_limits = {color: per_color + (i < extra) for i, color in enumerate(colors)}
+            for max_team_size in team_sizes:
+                grid.append(SweepConfig(color_limits, max_team_size, mode))
+    return grid
+
+
+MAX_SWEEP_CONFIGS = 48
+
+
+def parse_sweep_grid(team_counts: str, team_sizes: str, colors: List[str], modes: str = "indexed") -> List[SweepConfig]:
+    """Сетка из строк вида "5,10,20"; ValueError с понятным текстом, если параметры неверные."""
+    def numbers(raw: str, what: str) -> List[int]:
+        values = [part.strip() for part in raw.split(",") if part.strip()]
+        if not values or not all(value.isdigit() and int(value) > 0 for value in values):
+            raise ValueError(f"{what}: нужны положительные числа через запятую, получено {raw!r}")
+        return [int(value) for value in values]
+
+    mode_list = [mode.strip() for mode in modes.split(",") if mode.strip()] or ["indexed"]
+    unknown = [mode for mode in mode_list if mode not in PLANNERS]
+    if unknown:
+        raise ValueError(f"Неизвестные режимы: {', '.join(unknown)}. Доступны: {', '.join(PLANNERS)}")
+
+    grid = make_sweep_grid(numbers(team_counts, "Число команд"), numbers(team_sizes, "Размер команды"),
+                           colors, mode_list)
+    if len(grid) > MAX_SWEEP_CONFIGS:
+        raise ValueError(f"Слишком много конфигураций: {len(grid)}, максимум {MAX_SWEEP_CONFIGS}")
+    return grid
+
+
+_sweep_user_tags: Optional[List[Sequence[int]]] = None
+
+
+def _init_sweep_worker(participants):
+    global _sweep_user_tags
+    _sweep_user_tags = participants.tag_lists()
+
+
+def _run_sweep_config(config: SweepConfig) -> SweepRow:
+    started = time.monotonic()
+    teams = [{"id": None, "color": color, "members": 0, "tags": ()}
+             for color, limit in config.color_limits.items() for _ in range(max(limit, 0))]
+    placements = PLANNERS[config.mode](_sweep_user_tags, teams, config.color_limits, config.max_team_size)
+    placed = [placement for placement in placements if placement is not None]
+    capacity = len(teams) * config.max_team_size
+    return SweepRow(
+        config=config,
+        teams=len(teams),
+        placed=len(placed),
+        unplaced=len(placements) - len(placed),
+        overflow=sum(1 for placement in placed if placement.overflow),
+        conflicts=sum(placement.conflicts for placement in placed),
+        fill_rate=min(len(placed), capacity) / capacity if capacity else 0.0,
+        seconds=time.monotonic() - started,
+    )
+
+
+def run_sweep(participants, configs: List[SweepConfig], workers: Optional[int] = None) -> List[SweepRow]:
+    """Прогоняет планировщик для каждой конфигурации по одному снимку участников в пуле процессов.
+
+    participants — объект с tag_lists() (db.snapshot.ParticipantSnapshot), передаётся каждому
+    воркеру один раз; строки возвращаются в порядке configs.
+    """
+    if not configs:
+        return []
+    workers = min(len(configs), workers or os.cpu_count() or 1)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_sweep_worker,
+                             initargs=(participants,)) as pool:
+        return list(pool.map(_run_sweep_config, configs))
+
+
+def format_sweep_table(rows: List[SweepRow]) -> str:
+    """Компактная таблица сравнения конфигураций моноширинным текстом."""
+    lines = [f"{'команд':>6} {'размер':>6} {'режим':<10} {'конфл.':>6} {'без к.':>6} {'перепол.':>8} "
+             f"{'заполн.':>7} {'время':>7}"]
+    for row in rows:
+        lines.append(
+            f"{row.teams:>6} {row.config.max_team_size:>6} {row.config.mode:<10} {row.conflicts:>6} "
+            f"{row.unplaced:>6} {row.overflow:>8} {row.fill_rate:>7.0%} {row.seconds:>6.2f}s"
+        )
+    return "\n".join(lines)
@@ -1,9 +1,9 @@
 from fastapi import APIRouter, Request, Form
 from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.templating import Jinja2Templates
-from db.teams import TestTeamDistributor
+from db.teams import DistributionResult, TestTeamDistributor, run_what_if
+from services.team_logic import parse_sweep_grid
 from db.users import activate_all_users, deactivate_all_users
-import json
 import asyncio
 import os
 
@@ -12,107 +12,39 @@ templates = Jinja2Templates(directory="web/templates")
 router = APIRouter()
 LOG_FILE = "app.log"
 
-import re
-from collections import Counter
-
-
-def format_distribution_structured(lines):
-    teams = []
-    total_conflicts_counter = Counter()
-    total_conflicts_count = 0
-
-    current_team = None
-    members = []
-    conflict_tags_counter = Counter()
-
-    for line in lines:
-        line = line.strip()
-        if line.startswith("🟢 Команда"):
-            # Если есть текущая команда, сохраним её
-            if current_team is not None:
-                teams.append({
-                    "team_num": current_team["team_num"],
-                    "members_count": current_team["members_count"],
-                    "conflict_count": current_team["conflict_count"],
-                    "members": members,
-                    "conflict_tags_counter": dict(conflict_tags_counter),
-                })
-                total_conflicts_counter.update(conflict_tags_counter)
-                total_conflicts_count += current_team["conflict_count"]
-
-            # Парсим заголовок команды
-            m = re.match(r"🟢 Команда #(\d+) \((\d+) участников, (\d+) с конфликтами\)", line)
-            if not m:
-                continue
-
-            current_team = {
-                "team_num": int(m.group(1)),
-                "members_count": int(m.group(2)),
-                "conflict_count": int(m.group(3)),
+
+def distribution_to_dict(result: DistributionResult) -> dict:
+    """Результат распределения для JSON-ответа /run_command."""
+    return {
+        "teams": [
+            {
+                "id": team.id,
+                "color": team.color,
+                "size": team.size,
+                "conflict_users": team.conflict_users,
+                "members": [
+                    {"id": member.user_id, "name": member.username, "tags": member.tags,
+                     "conflicts": member.conflict_tags}
+                    for member in team.members
+                ],
             }
-            members = []
-            conflict_tags_counter = Counter()
-
-        elif current_team is not None and line and not line.startswith("📊"):
-            # Парсим участников — формат:
-            # "  428323022 | Оводенко Данил | Backend, Python, ... | OK"
-            parts = [p.strip() for p in line.split("|")]
-            if len(parts) < 4:
-                continue
-            uid, name, tags, status = parts
-            conflict_tags = []
-            if status.startswith("Конфликт:"):
-                conflict_tags = [tag.strip() for tag in status[len("Конфликт:"):].split(",")]
-                for tag in conflict_tags:
-                    conflict_tags_counter[tag] += 1
-            members.append({
-                "id": uid,
-                "name": name,
-                "tags": tags,
-                "status": status,
-                "conflicts": conflict_tags,
-            })
-
-        elif line.startswith("📊 Общая статистика конфликтов:"):
-            # Это строка с общей статистикой — её можно просто пропустить,
-            # или сохранить, если нужна
-            pass
-
-    # Добавим последнюю команду
-    if current_team is not None:
-        teams.append({
-            "team_num": current_team["team_num"],
-            "members_count": current_team["members_count"],
-            "conflict_count": current_team["conflict_count"],
-            "members": members,
-            "conflict_tags_counter": dict(conflict_tags_counter),
-        })
-        total_conflicts_counter.update(conflict_tags_counter)
-        total_conflicts_count += current_team["conflict_count"]
-
-    top3 = total_conflicts_counter.most_common(3)
-    most_conflict_tag = total_conflicts_counter.most_common(1)[0][0] if total_conflicts_counter else "нет"
-
-    overall_stats = {
-        "total_conflicts": total_conflicts_count,
-        "top3_conflicts": top3,
-        "most_conflict_tag": most_conflict_tag,
+            for team in result.teams
+        ],
+        "unplaced": [member.user_id for member in result.unplaced],
+        "total_conflicts": result.total_conflicts,
+        "top3_conflicts": result.conflict_tags.most_common(3),
     }
 
-    return {"teams": teams, "overall_stats": overall_stats}
-
 
-async def run_test_distribution():
-    push = []
+def simulate_test_distribution() -> DistributionResult:
     with TestTeamDistributor() as distributor:
         distributor.num_teams = 5
-        result = distributor.simulate_distribution(max_team_size=6)
-        for line in result:
-            push.append(line)
+        return distributor.simulate_distribution(max_team_size=6)
 
-    structured_data = format_distribution_structured(push)
-    output_json = json.dumps(structured_data, ensure_ascii=False, indent=2)
-    return output_json
+
+async def run_test_distribution():
+    # sqlite3 и планировщик синхронные — не держим event loop веб-сервера
+    return distribution_to_dict(await asyncio.to_thread(simulate_test_distribution))
 
 async def run_main_distribution():
     return "Результат основного распределения"
@@ -166,10 +98,42 @@ async def run_command_endpoint(command: str = Form(...)):
 
 @router.get("/test-team", response_class=HTMLResponse)
 async def test_teams(request: Request):
-    result_json = await run_test_distribution()
-    output = json.loads(result_json)
-    return templates.TemplateResponse("test_teams.html", {
+    result = await asyncio.to_thread(simulate_test_distribution)
+    return templates.TemplateResponse("test-teams.html", {
         "request": request,
-        "teams": output['teams'],
-        "overall_stats": output['overall_stats']
-    })
\ No newline at end of file
+        "result": result,
+    })
+
+
+@router.get("/what-if", response_class=JSONResponse)
+async def what_if(teams: str = "5", sizes: str = "6", modes: str = "indexed", colors: str = "",
+                  refresh: bool = False):
+    """Сравнение конфигураций распределения по снимку main.db без записи: /what-if?teams=5,10&sizes=4,6
+
+    refresh=1 перечитывает участников из базы вместо файла снимка (он живёт WHAT_IF_SNAPSHOT_TTL).
+    """
+    # Цвета на расчёт не влияют (все команды создаются заранее), только делят число команд в ответе
+    color_list = [color.strip() for color in colors.split(",") if color.strip()] or [""]
+    try:
+        grid = parse_sweep_grid(teams, sizes, color_list, modes)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    rows = await asyncio.to_thread(run_what_if, grid, refresh=refresh)
+    return {
+        "rows": [
+            {
+                "teams": row.teams,
+                "color_limits": row.config.color_limits,
+                "max_team_size": row.config.max_team_size,
+                "mode": row.config.mode,
+                "conflicts": row.conflicts,
+                "placed": row.placed,
+                "unplaced": row.unplaced,
+                "overflow": row.overflow,
+                "fill_rate": round(row.fill_rate, 3),
+                "seconds": round(row.seconds, 3),
+            }
+            for row in rows
+        ]
+    }